@@ -38,6 +38,8 @@ setuptools.setup(
         "console_scripts": [
             "strace2csv = stracepy.strace2csv:main",
             "strace_analyzer = stracepy.strace_analyzer:main",
+            "strace_fleet = stracepy.strace_fleet:main",
+            "strace_server = stracepy.strace_server:main",
         ]
     },
 )
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2021 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: MIT
+
+# pylint: disable=invalid-name, too-few-public-methods
+
+""" Path-prefix trie with file access counts aggregated per directory """
+
+import ast
+
+import pandas as pd
+
+###############################################################################
+
+
+class PathTrieNode:
+    """
+    One path component. The counts of a node include the counts of all paths
+    below it: 'count' is the number of syscalls whose filepath is the node
+    path or below it, 'errors' the number of those that failed, and
+    'syscall_time' their total syscall time. 'refs' is the number of syscalls
+    that refer to the node path or below it in any of their filepaths
+    (column 'all_filepaths'). 'files' is the number of distinct filepaths
+    below the node, and 'hits' the number of syscalls on the node path itself.
+    """
+
+    # Tries of large strace logs have millions of nodes
+    __slots__ = ("children", "count", "errors", "syscall_time", "refs", "files", "hits")
+
+    def __init__(self):
+        self.children = {}
+        self.count = 0
+        self.errors = 0
+        self.syscall_time = 0.0
+        self.refs = 0
+        self.files = 0
+        self.hits = 0
+
+
+class PathTrie:
+    """
+    Trie of the filepaths in a strace log, built from the distinct filepaths
+    so that the build time does not depend on the number of syscalls. Prefix
+    queries walk only the nodes below the prefix.
+    """
+
+    def __init__(self):
+        self.root = PathTrieNode()
+
+    @classmethod
+    def from_df(cls, df_strace):
+        """Build the trie given strace log dataframe"""
+        trie = cls()
+        df = pd.DataFrame(
+            {
+                "filepath": df_strace["filepath"],
+                "error": df_strace["ret_int"] == "-1",
+                "syscall_time": pd.to_numeric(
+                    df_strace["syscall_time"], errors="coerce"
+                ).fillna(0),
+            }
+        )
+        df = df[df["filepath"] != ""]
+        df = df.groupby("filepath", sort=False, observed=True).agg(
+            count=("error", "size"),
+            errors=("error", "sum"),
+            syscall_time=("syscall_time", "sum"),
+        )
+        for path, count, errors, syscall_time in df.itertuples(name=None):
+            trie.add(path, count, int(errors), syscall_time)
+        refs = df_strace["all_filepaths"].value_counts(sort=False)
+        for value, count in refs.items():
+            if value and value != "[]":
+                trie.add_refs(_list_str_to_list(value), count)
+        return trie
+
+    def add(self, path, count, errors=0, syscall_time=0.0):
+        """Add count syscalls on path to the path and all its parents"""
+        nodes = self._nodes(path, create=True)
+        new_file = nodes[-1].hits == 0
+        nodes[-1].hits += count
+        for node in nodes:
+            node.count += count
+            node.errors += errors
+            node.syscall_time += syscall_time
+            if new_file:
+                node.files += 1
+
+    def add_refs(self, paths, count):
+        """
+        Add count syscalls that refer to paths. Each node is counted once,
+        even if more than one of the paths is below it.
+        """
+        nodes = {}
+        for path in paths:
+            for node in self._nodes(path, create=True):
+                nodes[id(node)] = node
+        for node in nodes.values():
+            node.refs += count
+
+    def find(self, path):
+        """Return the node of path, or None if no filepath is below path"""
+        nodes = self._nodes(path, create=False)
+        return nodes[-1] if nodes else None
+
+    def walk(self, prefix=None, max_depth=None, min_count=0):
+        """
+        Yield (path, depth, node) tuples of prefix and the nodes below it in
+        depth-first order, children with the highest count first. Nodes
+        deeper than max_depth or with count less than min_count are pruned
+        together with the nodes below them. If prefix is None, walk all
+        filepaths: '/' and the top directories of relative filepaths have
+        depth 0.
+        """
+        if prefix is None:
+            stack = self._children(None, self.root, 0, min_count)
+        else:
+            prefix = _strip_path(prefix)
+            node = self.find(prefix)
+            if node is None or node.count < min_count:
+                return
+            stack = [(prefix, 0, node)]
+        while stack:
+            path, depth, node = stack.pop()
+            yield path or "/", depth, node
+            if max_depth is None or depth < max_depth:
+                stack.extend(self._children(path, node, depth + 1, min_count))
+
+    def filepaths(self, prefix=None):
+        """Yield (filepath, hits) of the accessed filepaths below prefix"""
+        for path, _depth, node in self.walk(prefix):
+            if node.hits:
+                yield path, node.hits
+
+    @staticmethod
+    def _children(path, node, depth, min_count):
+        # Children in the order they are popped from the end of the walk
+        # stack: the highest count last, ties by path
+        children = [
+            (name if path is None else path + "/" + name, depth, child)
+            for name, child in node.children.items()
+            if child.count >= min_count
+        ]
+        children.sort(key=lambda item: item[0], reverse=True)
+        children.sort(key=lambda item: item[2].count)
+        return children
+
+    def _nodes(self, path, create):
+        # Absolute paths begin with the component '' which is the node of '/'
+        node = self.root
+        nodes = []
+        for name in _strip_path(path).split("/"):
+            child = node.children.get(name)
+            if child is None:
+                if not create:
+                    return []
+                child = node.children[name] = PathTrieNode()
+            nodes.append(child)
+            node = child
+        return nodes
+
+
+def _list_str_to_list(value):
+    # Inverse of strace2csv '_tuple_to_list_str'. Most values are a list of
+    # one filepath that needs no escaping, which is much faster to slice
+    # than to evaluate.
+    if value.count("'") == 2 and "\\" not in value and value.startswith("['"):
+        return [value[2:-2]]
+    return ast.literal_eval(value)
+
+
+def _strip_path(path):
+    return path.rstrip("/") if path != "/" else ""
+
+
+################################################################################
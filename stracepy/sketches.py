@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2021 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: MIT
+
+# pylint: disable=invalid-name
+
+"""
+Fixed-memory sketches and sampling for approximate analysis of large strace
+logs. The sketches are updated with chunks of values (numpy arrays or pandas
+objects) rather than one value at a time.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+###############################################################################
+
+
+def hash_keys(df):
+    """Return uint64 hash of each row in dataframe df, or of each value in series"""
+    return pd.util.hash_pandas_object(df, index=False).to_numpy(dtype=np.uint64)
+
+
+class CountMinSketch:
+    """
+    Count-min sketch of key counts. An estimated count is never less than the
+    true count, and exceeds it by at most error_bound() with probability
+    1 - delta, where delta = exp(-depth).
+    """
+
+    def __init__(self, width=2**16, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    def _columns(self, hashes):
+        # Double hashing: row i uses hash h1 + i * h2
+        h1 = hashes & np.uint64(0xFFFFFFFF)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        width = np.uint64(self.width)
+        return [(h1 + np.uint64(i) * h2) % width for i in range(self.depth)]
+
+    def add(self, hashes, counts):
+        """Add counts of the keys with the given hashes"""
+        counts = np.asarray(counts, dtype=np.int64)
+        for row, columns in enumerate(self._columns(hashes)):
+            np.add.at(self.table[row], columns.astype(np.intp), counts)
+        self.total += int(counts.sum())
+
+    def estimate(self, hashes):
+        """Return the estimated counts of the keys with the given hashes"""
+        rows = [
+            self.table[row][columns.astype(np.intp)]
+            for row, columns in enumerate(self._columns(hashes))
+        ]
+        return np.min(rows, axis=0) if rows else np.zeros(0, dtype=np.int64)
+
+    def error_bound(self):
+        """Return the maximum overestimate of a count, with probability 1 - delta"""
+        return math.ceil(math.e / self.width * self.total)
+
+
+class HeavyHitters:
+    """
+    Approximate counts of the most frequent keys: count-min sketch of all
+    keys, and the candidate keys with the highest estimated counts
+    """
+
+    def __init__(self, keys, capacity=1000, width=2**16, depth=4):
+        self.keys = keys
+        self.capacity = capacity
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates = None
+
+    def add(self, df):
+        """Add the rows of dataframe df, counted by the key columns"""
+        if df.empty:
+            return
+        df = df.groupby(self.keys, sort=False, observed=True).size()
+        df = df.reset_index(name="count")
+        self.sketch.add(hash_keys(df[self.keys]), df["count"].to_numpy())
+        df = pd.concat([self.candidates, df[self.keys]], ignore_index=True)
+        df = df.drop_duplicates(ignore_index=True)
+        df["count"] = self.sketch.estimate(hash_keys(df[self.keys]))
+        self.candidates = df.nlargest(self.capacity, "count")[self.keys]
+
+    def result(self):
+        """
+        Return dataframe of the candidate keys, their estimated count, and
+        column 'error', the maximum overestimate of the count
+        """
+        if self.candidates is None:
+            return pd.DataFrame(columns=["count", "error"] + self.keys)
+        df = self.candidates.reset_index(drop=True)
+        df.insert(0, "count", self.sketch.estimate(hash_keys(df[self.keys])))
+        df.insert(1, "error", self.sketch.error_bound())
+        return df.sort_values("count", ascending=False, kind="stable")
+
+
+class HyperLogLog:
+    """
+    HyperLogLog estimate of the count of distinct values, with relative
+    standard error of relative_error()
+    """
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(2**precision, dtype=np.uint8)
+
+    def add(self, values):
+        """Add the distinct values in values"""
+        hashes = hash_keys(pd.Series(pd.unique(np.asarray(values, dtype=object))))
+        if not hashes.size:
+            return
+        p = np.uint64(self.precision)
+        index = (hashes >> (np.uint64(64) - p)).astype(np.intp)
+        rest = hashes << p
+        # Rank is the position of the leftmost 1-bit in the remaining bits,
+        # computed from 32-bit halves that are exact as floats
+        high = (rest >> np.uint64(32)).astype(np.float64)
+        low = (rest & np.uint64(0xFFFFFFFF)).astype(np.float64)
+        with np.errstate(divide="ignore"):
+            rank = np.where(
+                high > 0,
+                32 - np.floor(np.log2(high)),
+                64 - np.floor(np.log2(low)),
+            )
+        rank = np.where(rest == 0, 64 - self.precision + 1, rank)
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def count(self):
+        """Return the estimated count of distinct values"""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(2.0 ** -self.registers.astype(np.float64))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small counts
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def relative_error(self):
+        """Return the relative standard error of the estimate"""
+        return 1.04 / math.sqrt(len(self.registers))
+
+
+class TDigest:
+    """
+    Merging t-digest of a distribution for estimating its quantiles. The
+    centroids are sized with the arcsine scale function, so the quantiles
+    near 0 and 1 are the most accurate.
+    """
+
+    def __init__(self, compression=200):
+        self.compression = compression
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, values):
+        """Add the values in values, NaN values are ignored"""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not values.size:
+            return
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        means = np.concatenate([self.means, values])
+        weights = np.concatenate([self.weights, np.ones(len(values))])
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        # Centroids whose quantile midpoints fall in the same unit of the
+        # scale function k(q) = compression / (2 * pi) * asin(2q - 1) merge
+        total = weights.sum()
+        q = (np.cumsum(weights) - weights / 2) / total
+        k = self.compression / (2 * math.pi) * np.arcsin(2 * q - 1)
+        groups = np.floor(k)
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def count(self):
+        """Return the number of values added"""
+        return int(self.weights.sum())
+
+    def quantile(self, q):
+        """Return the estimated q-quantile, or NaN if no values were added"""
+        if not self.weights.size:
+            return math.nan
+        total = self.weights.sum()
+        positions = (np.cumsum(self.weights) - self.weights / 2) / total
+        positions = np.r_[0.0, positions, 1.0]
+        means = np.r_[self.min, self.means, self.max]
+        return float(np.interp(q, positions, means))
+
+
+class StratifiedSample:
+    """
+    Uniform random sample of rows in each stratum, for instance pid. Each
+    stratum gets an equal share of capacity rows but at least one row, so
+    the sample has at most capacity rows in total, or one row per stratum
+    if there are more strata than capacity. Rows are kept by the smallest
+    random keys (bottom-k sampling), which makes the sample of each stratum
+    uniform no matter how many rows are added at a time.
+    """
+
+    def __init__(self, stratum, capacity=100000, seed=0):
+        self.stratum = stratum
+        self.capacity = capacity
+        self.rng = np.random.default_rng(seed)
+        self.rows = None
+        self.seen = pd.Series(dtype=np.int64)
+
+    def add(self, df):
+        """Add the rows of dataframe df to the sample"""
+        if df.empty:
+            return
+        df = df.assign(_key=self.rng.random(len(df)))
+        counts = df[self.stratum].value_counts(sort=False)
+        self.seen = self.seen.add(counts, fill_value=0).astype(np.int64)
+        if self.rows is not None:
+            df = pd.concat([self.rows, df], ignore_index=True)
+        share = max(1, self.capacity // len(self.seen))
+        rank = df.groupby(self.stratum, sort=False, observed=True)["_key"].rank(
+            method="first"
+        )
+        self.rows = df[rank <= share].reset_index(drop=True)
+
+    def frame(self):
+        """
+        Return the sampled rows in the order they were added, with column
+        'weight': the number of rows each sampled row stands for
+        """
+        if self.rows is None:
+            return None
+        df = self.rows
+        kept = df[self.stratum].map(df[self.stratum].value_counts())
+        weight = df[self.stratum].map(self.seen) / kept
+        return df.drop(columns=["_key"]).assign(weight=weight.round(3))
+
+
+################################################################################
@@ -4,18 +4,21 @@
 #
 # SPDX-License-Identifier: MIT
 
-# pylint: disable=no-self-use, invalid-name, too-many-arguments
+# pylint: disable=no-self-use, invalid-name, too-many-arguments, unnecessary-pass
+# pylint: disable=too-many-instance-attributes
 
 """ This tool parses strace output to structured format """
 
 import argparse
+import cProfile
+import functools
+import hashlib
+import json
 import os
 import sys
 import re
 import logging
 
-import pandas as pd
-
 from stracepy.utils import (
     df_to_csv_file,
     current_func_name,
@@ -23,21 +26,74 @@ from stracepy.utils import (
     setup_logging,
     function_timeout,
     FunctionTimeoutError,
+    StageProfiler,
+    ColumnStore,
     LOGGER_NAME,
     LOG_SPAM,
 )
+from stracepy.strace_db import df_to_sqlite_file, is_sqlite_file, EVENTS_TABLE
 
 ###############################################################################
 
 _LOGGER = logging.getLogger(LOGGER_NAME)
 
+# Output columns, and the columns only output on debug or spam log levels
+OUTPUT_COLUMNS = [
+    "timestamp",
+    "pid",
+    "executable",
+    "syscall",
+    "filepath",
+    "all_filepaths",
+    "ret_int",
+    "ret_str",
+    "syscall_time",
+]
+DEBUG_COLUMNS = ["args", "found_by"]
+SPAM_COLUMNS = ["strace_line"]
+
+# Columns with few distinct values compared to the row count, these are
+# stored dictionary-encoded while parsing
+ENCODED_COLUMNS = [
+    "pid",
+    "executable",
+    "syscall",
+    "filepath",
+    "all_filepaths",
+    "ret_int",
+    "found_by",
+]
+
+# Columns of the process events: exits, kills, signals, and detaches
+EVENT_COLUMNS = ["timestamp", "pid", "executable", "event", "value", "detail"]
+ENCODED_EVENT_COLUMNS = ["pid", "executable", "event", "value"]
+
 ###############################################################################
 
 
+class StraceParseError(Exception):
+    """
+    Strace log parsing error. The arguments are the error messages: the
+    error itself, possibly followed by hints on how to fix it.
+    """
+
+    pass
+
+
 class StraceParser:
     """Implements strace log parser"""
 
-    def __init__(self, strace_log):
+    # Hot-path methods timed when profiling is enabled: method name, stage name
+    _PROFILED_METHODS = [
+        ("_match_pid_timestamp", "regex_match"),
+        ("_match_unfinished", "regex_match"),
+        ("_match_resumed", "regex_match"),
+        ("_match_complete", "regex_match"),
+        ("_find_filepaths", "find_filepaths"),
+        ("_get_bin_file", "get_bin_file"),
+    ]
+
+    def __init__(self, strace_log, profile=False):
         self.strace_log = strace_log
         exit_unless_accessible(self.strace_log)
         # Dictionary to store exec syscall details to be able to map pid with
@@ -46,21 +102,122 @@ class StraceParser:
         # Dictionary to store unfinished syscalls encountered when parsing
         # the strace log. Key: str(pid)+str(syscall), Value: [timestamp,args]
         self.unfinished_syscalls_stash = {}
-        # Dictionary to store parsed strace log entries
-        # Key: column header, Value: list of values for 'column-header'-column
-        self.entries = {}
-
-    def parse(self):
-        """Parse strace log"""
+        # Byte offset in the strace log that follows the last parsed line
+        self.offset = 0
+        # Column store for the parsed strace log entries
+        self.entries = ColumnStore(encoded=ENCODED_COLUMNS)
+        # Column store for the process events, see match_event
+        self.events = ColumnStore(encoded=ENCODED_EVENT_COLUMNS)
+        # Stage times and counters, the hot-path methods are only timed
+        # if profile is True
+        self.profiler = StageProfiler()
+        self.stats = self.profiler.counters
+        if profile:
+            for method, stage in self._PROFILED_METHODS:
+                func = getattr(self, method)
+                setattr(self, method, self.profiler.instrument(func, stage))
+
+    def parse(self, offset=0, partial_lines=True):
+        """
+        Parse strace log starting from byte offset. If partial_lines is False,
+        a last line that does not end with newline is not parsed, since the
+        rest of the line may not yet be written. After parsing, self.offset
+        is the byte offset that follows the last parsed line.
+        """
         _LOGGER.info("Parsing strace log: '%s'", self.strace_log)
-        with open(self.strace_log) as in_file:
-            for line in in_file:
-                self._parse_strace_line(line)
+        with self.profiler.stage("parse"), open(self.strace_log, "rb") as in_file:
+            in_file.seek(offset)
+            for raw_line in in_file:
+                if not partial_lines and not raw_line.endswith(b"\n"):
+                    break
+                offset += len(raw_line)
+                self._parse_strace_line(raw_line.decode("utf-8", errors="replace"))
+        self.offset = offset
+
+    def parse_line(self, line):
+        """Parse one strace log line, for instance from a stream"""
+        self._parse_strace_line(line)
+
+    def output_columns(self):
+        """Return the names of the output columns on the current log level"""
+        columns = list(OUTPUT_COLUMNS)
+        if _LOGGER.level != logging.NOTSET and _LOGGER.level <= logging.DEBUG:
+            columns += DEBUG_COLUMNS
+        if _LOGGER.level != logging.NOTSET and _LOGGER.level <= LOG_SPAM:
+            columns += SPAM_COLUMNS
+        return columns
+
+    def get_state(self):
+        """Return the parser state needed to continue parsing the strace log"""
+        return {
+            "offset": self.offset,
+            "exec_map": self.exec_map,
+            "unfinished_syscalls_stash": self.unfinished_syscalls_stash,
+        }
+
+    def set_state(self, state):
+        """Restore the parser state returned by get_state"""
+        self.offset = state["offset"]
+        self.exec_map = dict(state["exec_map"])
+        self.unfinished_syscalls_stash = dict(state["unfinished_syscalls_stash"])
+
+    def events_frame(self):
+        """Return the parsed process events as dataframe"""
+        return self.events.to_dataframe().reindex(columns=EVENT_COLUMNS)
+
+    def to_csv(self, filename, append=False):
+        """
+        Output the parsed data as csv file, and the process events, if there
+        are any, as csv file events_file(filename)
+        """
+        self._write(df_to_csv_file, filename, append)
+        name = events_file(filename)
+        if len(self.events):
+            # Appending to a missing file would leave out the header
+            self._write_events(df_to_csv_file, name, append and os.path.isfile(name))
+        elif not append and os.path.isfile(name):
+            # The events of an earlier conversion
+            os.remove(name)
+
+    def to_sqlite(self, filename, append=False):
+        """
+        Output the parsed data as SQLite database file, the process events
+        are in table EVENTS_TABLE
+        """
+        self._write(df_to_sqlite_file, filename, append)
+        self._write_events(
+            functools.partial(df_to_sqlite_file, table=EVENTS_TABLE), filename, append
+        )
+
+    def to_file(self, filename, append=False):
+        """
+        Output the parsed data in the format given by filename extension.
+        If append is True, the parsed rows are appended to the existing file.
+        """
+        if is_sqlite_file(filename):
+            self.to_sqlite(filename, append)
+        else:
+            self.to_csv(filename, append)
+
+    def _write(self, df_writer, filename, append):
+        with self.profiler.stage("dataframe"):
+            df = self.entries.to_dataframe()
+        if df.empty:
+            # Keep the header, the rows of later incremental runs append to it
+            df = df.reindex(columns=self.output_columns())
+        if append and df.empty:
+            _LOGGER.info("No new rows for: %s", filename)
+            return
+        with self.profiler.stage("write"):
+            df_writer(df, filename, append=append)
+        self.stats["rows_written"] += len(df)
 
-    def to_csv(self, filename):
-        """Output the parsed data as csv file"""
-        df = pd.DataFrame(self.entries)
-        df_to_csv_file(df, filename)
+    def _write_events(self, df_writer, filename, append):
+        df = self.events_frame()
+        if append and df.empty:
+            return
+        with self.profiler.stage("write"):
+            df_writer(df, filename, append=append)
 
     def _parse_strace_line(self, line):
         line = line.rstrip("\n")
@@ -74,12 +231,14 @@ class StraceParser:
         if syscall:
             # Stash the 'unfinished' entry for now, we'll resume processing
             # this entry when we encounter the corresponding 'resumed' entry
+            self.stats["lines_unfinished"] += 1
             self._stash_unifinished(line, pid, timestamp, syscall, args)
             return
 
         # Match 'resumed' entries
         syscall, args, ret_int, ret_str, time = self._match_resumed(rest)
         if syscall:
+            self.stats["lines_resumed"] += 1
             # Find the 'unfinished' entry that corresponds this 'resumed' entry.
             # For the timestamp, we use the timestamp the syscall resumed, not
             # the timestamp when the call was initiated (_stashed_timestamp)
@@ -89,7 +248,7 @@ class StraceParser:
             args = stashed_args + args
             # Find filepaths that appear in the args or ret_str, limiting
             # the search to first n-characters of each
-            filepaths = find_filepaths(args[:500] + ret_str[:500])
+            filepaths = self._find_filepaths(args[:500] + ret_str[:500])
             foundby = "resumed"
             # We now have all the fields populated for the previously
             # 'unfinished' entry: store it now and move on to the next log entry
@@ -110,9 +269,10 @@ class StraceParser:
         # Match 'complete' entries
         syscall, args, ret_int, ret_str, time = self._match_complete(rest)
         if syscall:
+            self.stats["lines_complete"] += 1
             # Find filepaths that appear in the args or ret_str, limiting
             # the search to first n-characters of each
-            filepaths = find_filepaths(args[:500] + ret_str[:500])
+            filepaths = self._find_filepaths(args[:500] + ret_str[:500])
             foundby = "complete"
             # Store the entry and move on to the next log entry
             self._add_entry(
@@ -129,16 +289,37 @@ class StraceParser:
             )
             return
 
+        # Match process events: exits, kills, signals, and detaches
+        if self._parse_event_line(pid, timestamp, rest):
+            return
+
         # For debugging: log entries that didn't match any parsers
+        self.stats["lines_unparsed"] += 1
         _LOGGER.log(LOG_SPAM, "Nothing parsed from line: '%s'", line)
 
+    def _parse_event_line(self, pid, timestamp, rest):
+        # Return True if rest is a process event, see match_event
+        event, value, detail = match_event(rest)
+        if not event:
+            return False
+        self.stats["lines_event"] += 1
+        if event == "detached":
+            # The detached syscall does not resume
+            self.unfinished_syscalls_stash.pop(str(pid) + value, None)
+        elif event in ("exited", "killed"):
+            # Nor do the unfinished syscalls of a process that ended
+            self._unstash_pid(pid)
+        self._add_event(pid, timestamp, event, value, detail)
+        return True
+
     def _match_pid_timestamp(self, line):
         re_pid_tstamp = re.compile(r"^(?P<pid>\d+)\s+(?P<tstamp>[^ ]+)\s+(?P<rest>.*)$")
         match = re_pid_tstamp.match(line)
         if not match:
-            _LOGGER.error("Strace log is missing pid and/or timestamp: %s", line)
-            _LOGGER.error("Hint: run strace with options: '-f -tt -T -y -yy -s 2048'")
-            sys.exit(1)
+            raise StraceParseError(
+                "Strace log is missing pid and/or timestamp: %s" % line,
+                "Hint: run strace with options: '-f -tt -T -y -yy -s 2048'",
+            )
         pid = match.group("pid")
         tstamp = match.group("tstamp")
         rest = match.group("rest")
@@ -204,35 +385,47 @@ class StraceParser:
     def _stash_unifinished(self, line, pid, timestamp, syscall, args):
         key = str(pid) + str(syscall)
         if key in self.unfinished_syscalls_stash:
-            _LOGGER.error("Duplicate unfinished syscalls: %s", line)
-            sys.exit(1)
+            raise StraceParseError("Duplicate unfinished syscalls: %s" % line)
         value = [timestamp, args]
         self.unfinished_syscalls_stash[key] = value
+        self.profiler.high_water(
+            "stash_high_water", len(self.unfinished_syscalls_stash)
+        )
 
     def _unstash_on_resume(self, line, pid, syscall):
         key = str(pid) + str(syscall)
         if key not in self.unfinished_syscalls_stash:
-            _LOGGER.error("No 'unfinished' entry for: %s", line)
-            sys.exit(1)
+            raise StraceParseError("No 'unfinished' entry for: %s" % line)
         value = self.unfinished_syscalls_stash[key]
         del self.unfinished_syscalls_stash[key]
         timestamp = value[0]
         args = value[1]
         return (timestamp, args)
 
+    def _unstash_pid(self, pid):
+        # Keys are pid followed by syscall, and syscall names do not begin
+        # with a digit
+        for key in list(self.unfinished_syscalls_stash):
+            if key.startswith(pid) and not key[len(pid)].isdigit():
+                del self.unfinished_syscalls_stash[key]
+
+    def _find_filepaths(self, from_str):
+        return find_filepaths(from_str, stats=self.stats)
+
     def _get_bin_file(self, syscall, pid, filepath, ret_int, line):
         bin_file = ""
 
-        # Sanity check
-        if pid == "" or syscall == "" or ret_int == "" or ret_int == "?":
+        # Sanity check, 'resumed' return values may also have '?' in them
+        if pid == "" or syscall == "" or ret_int == "" or "?" in ret_int:
             return bin_file
         ret_int = int(ret_int)
 
         # Handle 'exec*' syscalls
         if syscall.startswith("exec") and ret_int >= 0:
             if filepath == "":
-                _LOGGER.error("Missing filepath from exec* syscall: '%s'", line)
-                sys.exit(1)
+                raise StraceParseError(
+                    "Missing filepath from exec* syscall: '%s'" % line
+                )
             bin_file = filepath
             # Add/replace the entry in exec_map:
             self.exec_map[pid] = bin_file
@@ -243,8 +436,7 @@ class StraceParser:
             child_pid = str(ret_int)
             # Child process initially executes the same program as the parent
             if pid not in self.exec_map:
-                _LOGGER.error("Parent program unknown: '%s'", line)
-                sys.exit(1)
+                raise StraceParseError("Parent program unknown: '%s'" % line)
             bin_file = self.exec_map[pid]
             # Add/replace the entry in exec_map:
             self.exec_map[child_pid] = bin_file
@@ -273,32 +465,203 @@ class StraceParser:
         line,
     ):
 
-        # Populate 'first_filepath' and 'all_filepaths'
+        # Populate 'first_filepath'
         first_filepath = ""
         if filepaths:
             first_filepath = filepaths[0]
-        all_filepaths = str(filepaths)
+        self.stats["paths_extracted"] += len(filepaths)
+        self.stats["syscalls"] += 1
+        if ret_int == "-1":
+            self.stats["syscalls_failed"] += 1
 
         # Populate 'bin_file'
         bin_file = self._get_bin_file(syscall, pid, first_filepath, ret_int, line)
 
-        # Add entry to entries dictionary
-        setcol = self.entries.setdefault
-        setcol("timestamp", []).append(timestamp)
-        setcol("pid", []).append(pid)
-        setcol("executable", []).append(bin_file)
-        setcol("syscall", []).append(syscall)
-        setcol("filepath", []).append(first_filepath)
-        setcol("all_filepaths", []).append(all_filepaths)
-        setcol("ret_int", []).append(ret_int)
-        setcol("ret_str", []).append(ret_str.strip())
-        setcol("syscall_time", []).append(time)
+        # Add entry to the column store
+        col = self.entries.column
+        col("timestamp").append(timestamp)
+        col("pid").append(pid)
+        col("executable").append(bin_file)
+        col("syscall").append(syscall)
+        col("filepath").append(first_filepath)
+        # 'all_filepaths' is the string representation of the filepaths list,
+        # computed once per distinct list
+        col("all_filepaths").append(tuple(filepaths), _tuple_to_list_str)
+        col("ret_int").append(ret_int)
+        col("ret_str").append(ret_str.strip())
+        col("syscall_time").append(time)
         # Following fields are only for debugging purposes
         if _LOGGER.level != logging.NOTSET and _LOGGER.level <= logging.DEBUG:
-            setcol("args", []).append(args)
-            setcol("found_by", []).append(foundby)
+            col("args").append(args)
+            col("found_by").append(foundby)
         if _LOGGER.level != logging.NOTSET and _LOGGER.level <= LOG_SPAM:
-            setcol("strace_line", []).append(line)
+            col("strace_line").append(line)
+
+    def _add_event(self, pid, timestamp, event, value, detail):
+        col = self.events.column
+        col("timestamp").append(timestamp)
+        col("pid").append(pid)
+        col("executable").append(self.exec_map.get(pid, ""))
+        col("event").append(event)
+        col("value").append(value)
+        col("detail").append(detail)
+
+
+def match_event(rest):
+    """
+    Match process event given the strace log line without pid and timestamp.
+    Return tuple (event, value, detail), or empty strings if rest is not an
+    event:
+      - 'exited': exit code
+      - 'killed': signal, detail is '(core dumped)' if the process dumped core
+      - 'signal': signal delivered to the process, detail is the siginfo
+      - 'stopped': signal that stopped the process
+      - 'superseded': pid of the thread whose execve replaced the process
+      - 'detached': syscall that was interrupted by strace detaching
+    """
+    re_exited = re.compile(r"^\+\+\+ exited with (?P<value>-?\d+) \+\+\+$")
+    re_killed = re.compile(
+        r"^\+\+\+ killed by (?P<value>SIG[0-9A-Z]+|\d+)"
+        r"(?: (?P<detail>\(core dumped\)))? \+\+\+$"
+    )
+    re_superseded = re.compile(
+        r"^\+\+\+ superseded by execve in pid (?P<value>\d+) \+\+\+$"
+    )
+    re_signal = re.compile(r"^--- (?P<value>SIG[0-9A-Z+]+|\d+) (?P<detail>\{.*\}) ---$")
+    re_stopped = re.compile(r"^--- stopped by (?P<value>SIG[0-9A-Z]+|\d+) ---$")
+    re_detached = re.compile(
+        r"^(?:<\.\.\.\s+(?P<resumed>[0-9a-z_]+)\s+resumed>|(?P<syscall>[0-9a-z_]+)\()"
+        r".*<detached\s+\.\.\.>$"
+    )
+    for event, re_event in [
+        ("exited", re_exited),
+        ("killed", re_killed),
+        ("signal", re_signal),
+        ("stopped", re_stopped),
+        ("superseded", re_superseded),
+    ]:
+        match = re_event.match(rest)
+        if match:
+            return (event, match.group("value"), match.groupdict("").get("detail", ""))
+    match = re_detached.match(rest)
+    if match:
+        return ("detached", match.group("resumed") or match.group("syscall"), "")
+    return ("", "", "")
+
+
+def _tuple_to_list_str(values):
+    return str(list(values))
+
+
+###############################################################################
+
+
+def events_file(out):
+    """
+    Return the name of the csv file that stores the process events for csv
+    output file out, for instance 'strace.events.csv' for 'strace.csv'
+    """
+    root, ext = os.path.splitext(str(out))
+    return root + ".events" + (ext or ".csv")
+
+
+def checkpoint_file(out):
+    """Return the name of the checkpoint file for output file out"""
+    return str(out) + ".checkpoint"
+
+
+def _file_head_digest(name, size):
+    with open(name, "rb") as in_file:
+        return hashlib.sha1(in_file.read(size)).hexdigest()
+
+
+def read_checkpoint(out, strace_parser):
+    """
+    Return the checkpoint written by the previous incremental conversion to
+    output file out, or None if there is no checkpoint, or the checkpoint
+    does not match the strace log, the output file, or the output columns
+    """
+    name = checkpoint_file(out)
+    if not os.path.isfile(name):
+        return None
+    try:
+        with open(name, encoding="utf-8") as in_file:
+            checkpoint = json.load(in_file)
+        reason = None
+        log_size = os.path.getsize(strace_parser.strace_log)
+        if checkpoint["strace_log"] != os.path.abspath(strace_parser.strace_log):
+            reason = "different strace log"
+        elif not os.path.isfile(out):
+            reason = "output file is missing"
+        elif os.stat(out).st_size != checkpoint["out_size"]:
+            reason = "output file has changed"
+        elif os.stat(out).st_mtime_ns != checkpoint["out_mtime_ns"]:
+            reason = "output file has changed"
+        elif checkpoint["events_file"] and not os.path.isfile(events_file(out)):
+            reason = "events file is missing"
+        elif log_size < checkpoint["state"]["offset"]:
+            reason = "strace log is shorter than the checkpoint offset"
+        elif (
+            _file_head_digest(strace_parser.strace_log, checkpoint["head_size"])
+            != checkpoint["head_sha1"]
+        ):
+            reason = "strace log has changed"
+        elif checkpoint["columns"] != strace_parser.output_columns():
+            reason = "output columns have changed"
+    except (OSError, ValueError, KeyError, TypeError) as ex:
+        reason = "invalid checkpoint: %s" % ex
+    if reason:
+        _LOGGER.info("Ignoring checkpoint '%s': %s", name, reason)
+        return None
+    return checkpoint
+
+
+def write_checkpoint(out, strace_parser, rows):
+    """
+    Write checkpoint for output file out, so that the next incremental
+    conversion can continue from the current parser state
+    """
+    state = strace_parser.get_state()
+    head_size = min(state["offset"], 4096)
+    checkpoint = {
+        "strace_log": os.path.abspath(strace_parser.strace_log),
+        "head_size": head_size,
+        "head_sha1": _file_head_digest(strace_parser.strace_log, head_size),
+        "out_size": os.stat(out).st_size,
+        "out_mtime_ns": os.stat(out).st_mtime_ns,
+        "columns": strace_parser.output_columns(),
+        "rows": rows,
+        # Csv output has an events file once there are events
+        "events_file": not is_sqlite_file(out) and os.path.isfile(events_file(out)),
+        "state": state,
+    }
+    name = checkpoint_file(out)
+    with open(name + ".tmp", "w", encoding="utf-8") as out_file:
+        json.dump(checkpoint, out_file)
+    os.replace(name + ".tmp", name)
+    _LOGGER.debug("Wrote: %s", name)
+
+
+def convert_incremental(strace_parser, out):
+    """
+    Convert the strace log to output file out. If the previous incremental
+    conversion of the same strace log left a valid checkpoint, parse only the
+    lines appended to the strace log since, and append the new rows to out.
+    """
+    checkpoint = read_checkpoint(out, strace_parser)
+    rows = 0
+    if checkpoint:
+        strace_parser.set_state(checkpoint["state"])
+        rows = checkpoint["rows"]
+        _LOGGER.info(
+            "Resuming from checkpoint: %s rows, byte offset %s",
+            rows,
+            strace_parser.offset,
+        )
+    strace_parser.parse(strace_parser.offset, partial_lines=False)
+    rows += len(strace_parser.entries)
+    strace_parser.to_file(out, append=checkpoint is not None)
+    write_checkpoint(out, strace_parser, rows)
 
 
 ###############################################################################
@@ -306,8 +669,11 @@ class StraceParser:
 
 # Timeout find_filepaths function afer 0.1 seconds
 @function_timeout(0.1)
-def find_filepaths(from_str, retry=True):
-    """Attempt to match strings that look like file paths in strace log entry"""
+def find_filepaths(from_str, retry=True, stats=None):
+    """
+    Attempt to match strings that look like file paths in strace log entry.
+    If stats is given, count the timeouts and retries in it.
+    """
     try:
         # This is pretty rough heuristic and might match both
         # false positives and false negatives
@@ -329,11 +695,15 @@ def find_filepaths(from_str, retry=True):
         return matches
     except FunctionTimeoutError as _ex:
         _LOGGER.debug("timed-out while matching: '%s'", from_str[:100] + "...")
+        if stats is not None:
+            stats["find_filepaths_timeouts"] += 1
         if retry:
             # If the regex match timed-out, retry the match
             # reducing the string to 200 characters
             from_str = from_str[0:200]
-            return find_filepaths(from_str, False)
+            if stats is not None:
+                stats["find_filepaths_retries"] += 1
+            return find_filepaths(from_str, False, stats)
 
         _LOGGER.warning("%s failed matching: '%s'", current_func_name(), from_str)
         return [""]
@@ -347,7 +717,8 @@ def getargs():
     desc = (
         "This tool parses strace output STRACE_LOG to structured format. "
         "Output [OUT] is a CSV file that allows post-processing the "
-        "strace output log with other tools that can digest CSV data. "
+        "strace output log with other tools that can digest CSV data, "
+        "or a SQLite database if OUT has extension .db, .sqlite, or .sqlite3. "
         "This tool assumes STRACE_LOG "
         "was generated with strace options '-f -tt -T -y -yy -s 2048'. "
     )
@@ -363,19 +734,91 @@ def getargs():
     helpstr = "set the verbose level between 0-3 (defaults to --verbose=1)"
     parser.add_argument("--verbose", help=helpstr, type=int, default=1)
 
-    return parser.parse_args()
+    helpstr = (
+        "save a checkpoint next to the output file ('OUT.checkpoint'), and "
+        "if the previous --incremental conversion of the same strace log left "
+        "one, parse only the lines appended to STRACE_LOG since and append the "
+        "new rows to OUT"
+    )
+    parser.add_argument("--incremental", help=helpstr, action="store_true")
+
+    group = parser.add_argument_group("approximate conversion options")
+    helpstr = (
+        "output only a random sample of the syscalls of each pid, with column "
+        "'weight' that is the number of syscalls each sampled row stands for. "
+        "The strace log is parsed with a faster but less careful parser, and "
+        "the error bounds of the approximate analysis are logged."
+    )
+    group.add_argument("--approx", help=helpstr, action="store_true")
+    helpstr = "number of syscalls in the sample (defaults to --sample-rows=100000)"
+    group.add_argument("--sample-rows", help=helpstr, type=int, default=100000)
+
+    group = parser.add_argument_group("profiling options")
+    helpstr = (
+        "time the parsing stages, count the parsed lines, extracted paths, "
+        "and find_filepaths timeouts, and print the summary"
+    )
+    group.add_argument("--profile", help=helpstr, action="store_true")
+    helpstr = "write the profiling summary to this json file (implies --profile)"
+    group.add_argument("--profile-json", help=helpstr)
+    helpstr = "write cProfile statistics of the run to this file"
+    group.add_argument("--cprofile", help=helpstr)
+
+    args = parser.parse_args()
+    if args.approx and args.incremental:
+        parser.error("--approx can not be used with --incremental")
+    return args
 
 
 ################################################################################
 
 
+def convert_approx(strace_log, out, sample_rows):
+    """Output a random sample of the syscalls in strace_log to out"""
+    # strace_approx builds on this module, so it is imported only here
+    # pylint: disable=import-outside-toplevel
+    from stracepy.strace_approx import ApproxAnalyzer
+
+    analyzer = ApproxAnalyzer(sample_rows)
+    analyzer.read_strace_log(strace_log)
+    analyzer.sample_to_file(out)
+
+
 def main():
     """main entry point"""
     parsed_args = getargs()
     setup_logging(parsed_args.verbose)
-    strace_parser = StraceParser(parsed_args.STRACE_LOG[0])
-    strace_parser.parse()
-    strace_parser.to_csv(parsed_args.out)
+    if parsed_args.approx:
+        convert_approx(
+            parsed_args.STRACE_LOG[0], parsed_args.out, parsed_args.sample_rows
+        )
+        return
+    profile = parsed_args.profile or bool(parsed_args.profile_json)
+    strace_parser = StraceParser(parsed_args.STRACE_LOG[0], profile=profile)
+    cprofiler = cProfile.Profile() if parsed_args.cprofile else None
+    if cprofiler:
+        cprofiler.enable()
+    try:
+        with strace_parser.profiler.stage("total"):
+            if parsed_args.incremental:
+                convert_incremental(strace_parser, parsed_args.out)
+            else:
+                strace_parser.parse()
+                strace_parser.to_file(parsed_args.out)
+                if os.path.exists(checkpoint_file(parsed_args.out)):
+                    os.remove(checkpoint_file(parsed_args.out))
+    except StraceParseError as ex:
+        for message in ex.args:
+            _LOGGER.error("%s", message)
+        sys.exit(1)
+    if cprofiler:
+        cprofiler.disable()
+        cprofiler.dump_stats(parsed_args.cprofile)
+        _LOGGER.info("Wrote: %s", parsed_args.cprofile)
+    if parsed_args.profile:
+        strace_parser.profiler.print_summary()
+    if parsed_args.profile_json:
+        strace_parser.profiler.to_json_file(parsed_args.profile_json)
 
 
 if __name__ == "__main__":
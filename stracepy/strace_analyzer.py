@@ -4,24 +4,49 @@
 #
 # SPDX-License-Identifier: MIT
 
-# pylint: disable=invalid-name, too-few-public-methods
+# pylint: disable=invalid-name, too-few-public-methods, too-many-arguments
 
 """ Analyze and query strace log given the strace log in CSV format """
 
 import argparse
+import inspect
 import logging
 import os
+import re
+import sqlite3
+
+import numpy as np
+import pandas as pd
 
 from stracepy.utils import (
     df_regex_filter,
+    df_timestamp_seconds,
+    df_to_csv_file,
+    df_top,
+    output_top,
     wrap_text,
     current_func_name,
     print_df,
     exit_unless_accessible,
     setup_logging,
+    setup_output_from_args,
+    add_output_arguments,
     df_from_csv_file,
+    SmartFormatter,
     LOGGER_NAME,
 )
+from stracepy.path_trie import PathTrie
+from stracepy.strace_db import (
+    df_from_sqlite,
+    df_to_sqlite,
+    is_sqlite_file,
+    set_read_only,
+    sqlite_connect,
+    table_exists,
+    EVENTS_TABLE,
+    SYSCALLS_TABLE,
+)
+from stracepy.strace2csv import events_file, EVENT_COLUMNS
 
 ###############################################################################
 
@@ -29,6 +54,21 @@ _LOGGER = logging.getLogger(LOGGER_NAME)
 
 RE_DEVICE_FILE = "^/dev/|^/sys/devices/|^/sys/.*/gpio"
 
+# Syscalls that create a process or thread and return its pid
+SPAWN_SYSCALLS = ["clone", "clone3", "fork", "vfork"]
+
+# Columns command 'rate' can count the syscalls per
+RATE_GROUP_BY = ["syscall", "executable", "pid"]
+# Maximum number of preceding buckets of the rolling baseline of 'rate'
+RATE_BASELINE_WINDOW_MAX = 1000
+# Maximum number of counts held at a time while computing the baseline
+BASELINE_CELLS = 2**20
+
+# Path components that are numbers, such as pids in '/proc/1234/maps'
+RE_NUMERIC_COMPONENT = re.compile(r"(?<=/)\d+(?=/|$)")
+# Numeric suffixes in file names, such as '/tmp/app-12345.lock'
+RE_NUMERIC_SUFFIX = re.compile(r"(?<=[-_.])\d{3,}(?=[-_.]|$)")
+
 ###############################################################################
 
 
@@ -47,40 +87,61 @@ def programs_executed(df_strace):
     df = df_regex_filter(df_strace, "syscall", "^exec.*")
     df = df[["timestamp", "executable", "syscall", "filepath", "ret_int", "ret_str"]]
     df = df.sort_values(["timestamp"], ascending=True)
-    if not df.empty:
-        print("\n\n%s:\n" % wrap_text(command_dict[current_func_name()][1]))
-        print_df(df)
+    print_df(df, title=command_dict[current_func_name()][1])
 
 
 def count_errors(df_strace):
     """
     Count of failed syscalls
     """
+    df = count_errors_result(count_errors_partial(df_strace))
+    df = df_top(df, "count")
+    print_df(df, title=command_dict[current_func_name()][1])
+
+
+def count_errors_partial(df_strace):
+    """
+    Return the count of failed syscalls per executable, syscall, and error.
+    Counts from more than one strace log are merged with sum.
+    """
     df = df_strace[(df_strace["ret_int"] == "-1")]
-    df = (
+    return (
         df.groupby(["executable", "syscall", "ret_str"])
         .size()
         .reset_index(name="count")
     )
-    df = df[["count", "executable", "syscall", "ret_str"]]
-    df = df.sort_values(["count"], ascending=False)
-    if not df.empty:
-        print("\n\n%s:\n" % wrap_text(command_dict[current_func_name()][1]))
-        print_df(df)
+
+
+def count_errors_result(df):
+    """Return the count_errors output given the counts from count_errors_partial"""
+    return df[["count", "executable", "syscall", "ret_str"]]
 
 
 def count_files(df_strace, filter_filepath=".+", filter_ret_int=".*"):
     """
     Count of file accesses
     """
+    df = count_files_result(
+        count_files_partial(df_strace, filter_filepath, filter_ret_int)
+    )
+    df = df_top(df, "count")
+    print_df(df, title=command_dict[current_func_name()][1])
+
+
+def count_files_partial(df_strace, filter_filepath=".+", filter_ret_int=".*"):
+    """
+    Return the count of file accesses per executable and filepath, of the
+    syscalls whose filepath and ret_int match the filters. Counts from more
+    than one strace log are merged with sum.
+    """
     df = df_regex_filter(df_strace, "filepath", filter_filepath)
     df = df_regex_filter(df, "ret_int", filter_ret_int)
-    df = df.groupby(["executable", "filepath"]).size().reset_index(name="count")
-    df = df[["count", "executable", "filepath"]]
-    df = df.sort_values(["count"], ascending=False)
-    if not df.empty:
-        print("\n\n%s:\n" % wrap_text(command_dict[current_func_name()][1]))
-        print_df(df)
+    return df.groupby(["executable", "filepath"]).size().reset_index(name="count")
+
+
+def count_files_result(df):
+    """Return the count_files output given the counts from count_files_partial"""
+    return df[["count", "executable", "filepath"]]
 
 
 def count_device_files(df_strace):
@@ -98,9 +159,7 @@ def file_access(df_strace, filter_filepath=".+", filter_ret_int=".*"):
     df = df_regex_filter(df_strace, "filepath", filter_filepath)
     df = df_regex_filter(df, "ret_int", filter_ret_int)
     df = df[["timestamp", "executable", "syscall", "filepath", "ret_int", "ret_str"]]
-    if not df.empty:
-        print("\n\n%s:\n" % wrap_text(command_dict[current_func_name()][1]))
-        print_df(df)
+    print_df(df, title=command_dict[current_func_name()][1])
 
 
 def file_access_errors(df_strace):
@@ -119,6 +178,402 @@ def device_file_access(df_strace):
     file_access(df_strace, filter_filepath=RE_DEVICE_FILE)
 
 
+def file_tree(df_strace, path_prefix=None, depth=3, min_count=1):
+    """
+    File accesses rolled up by directory: for each directory, the count of
+    syscalls on the files below it, of failed syscalls, and their total
+    syscall time. Column 'refs' also counts the syscalls that refer to the
+    files in any of their filepaths, and 'files' is the number of distinct
+    filepaths below the directory. Directories deeper than depth or with
+    count less than min_count are not shown.
+    """
+    trie = PathTrie.from_df(df_strace)
+    rows = [
+        (level, path, node.count, node.errors, node.syscall_time, node.refs, node.files)
+        for path, level, node in trie.walk(path_prefix, depth, min_count)
+    ]
+    columns = ["depth", "path", "count", "errors", "syscall_time", "refs", "files"]
+    df = pd.DataFrame(rows, columns=columns)
+    df["syscall_time"] = df["syscall_time"].round(6)
+    print_df(df, title=command_dict[current_func_name()][1])
+
+
+def rate(
+    df_strace,
+    *,
+    bucket=1.0,
+    group_by="syscall",
+    baseline_window=10,
+    burst_factor=3.0,
+    rate_csv=None,
+):
+    """
+    Syscall rate over time: count syscalls per time bucket and flag the
+    buckets where the count exceeds the rolling baseline. Only the buckets
+    where a group has syscalls are output, the empty buckets count as zero
+    in the baseline.
+    """
+    seconds = df_timestamp_seconds(df_strace)
+    df = pd.DataFrame(
+        {
+            "bucket": (seconds - seconds.min()) // bucket,
+            group_by: df_strace[group_by],
+        }
+    ).dropna(subset=["bucket"])
+    if df.empty:
+        return
+    df["bucket"] = df["bucket"].astype("int64")
+    df = df.groupby(["bucket", group_by], observed=True).size()
+    df = df.reset_index(name="count")
+    df["baseline"] = _rolling_baseline(df, group_by, baseline_window)
+    df["burst"] = df["baseline"].notna() & (
+        df["count"] >= burst_factor * df["baseline"].clip(lower=1)
+    )
+    df["baseline"] = df["baseline"].fillna(0)
+    df.insert(1, "t_start", (df["bucket"] * bucket).round(6))
+    df["rate_per_s"] = (df["count"] / bucket).round(3)
+    df = df[["bucket", "t_start", group_by, "count", "rate_per_s", "baseline", "burst"]]
+    if rate_csv:
+        df_to_csv_file(df, rate_csv)
+    df = df[df["burst"]].drop(columns=["burst"])
+    print_df(df, title=command_dict[current_func_name()][1])
+
+
+def _rolling_baseline(df, group_by, window):
+    # Median count of the group in the preceding window buckets, given the
+    # rows of the non-empty buckets: one row per bucket and group with its
+    # count. Missing buckets count as zero, buckets before the first one are
+    # not counted, and the first bucket has no baseline. The rows are
+    # processed in chunks so that at most BASELINE_CELLS counts are held.
+    group_codes, groups = pd.factorize(df[group_by])
+    buckets = df["bucket"].to_numpy()
+    index = pd.Index(buckets * len(groups) + group_codes)
+    counts = df["count"].to_numpy().astype(float)
+    baseline = np.full(len(df), np.nan)
+    chunk_rows = max(1, BASELINE_CELLS // window)
+    for start in range(0, len(df), chunk_rows):
+        rows = slice(start, start + chunk_rows)
+        lags = _lag_counts(index, counts, rows, len(groups), window)
+        has_baseline = buckets[rows] > 0
+        chunk = baseline[rows]
+        chunk[has_baseline] = np.nanmedian(lags[has_baseline], axis=1)
+    return baseline
+
+
+def _lag_counts(index, counts, rows, stride, window):
+    # Counts of the same group in each of the window preceding buckets of
+    # the rows, given index of keys 'bucket * stride + group code'. NaN for
+    # the buckets before the first one.
+    keys = index.to_numpy()[rows]
+    lags = np.empty((len(keys), window))
+    for lag in range(1, window + 1):
+        found = index.get_indexer(keys - lag * stride)
+        lags[:, lag - 1] = np.where(found >= 0, counts[found], 0)
+        lags[keys // stride < lag, lag - 1] = np.nan
+    return lags
+
+
+def error_clusters(df_strace):
+    """
+    Failed syscalls grouped into clusters by executable, syscall, error, and
+    normalized filepath. Numeric path components are replaced with '<N>', and
+    failures for the same file name in more than one directory, such as
+    library search path probes, are collapsed to '*/<file name>'.
+    """
+    df = df_strace[(df_strace["ret_int"] == "-1")]
+    if df.empty:
+        return
+    # Normalize each distinct filepath and error string only once
+    path_codes, paths = pd.factorize(df["filepath"])
+    error_codes, errors = pd.factorize(df["ret_str"])
+    errors = pd.Series([error.split(" ", 1)[0] for error in errors], dtype=object)
+    df = pd.DataFrame(
+        {
+            "executable": df["executable"].to_numpy(),
+            "syscall": df["syscall"].to_numpy(),
+            "error": errors.to_numpy()[error_codes],
+            "path_code": path_codes,
+            "syscall_time": pd.to_numeric(df["syscall_time"], errors="coerce")
+            .fillna(0)
+            .to_numpy(),
+        }
+    )
+    df = (
+        df.groupby(["executable", "syscall", "error", "path_code"])
+        .agg(count=("syscall_time", "size"), syscall_time=("syscall_time", "sum"))
+        .reset_index()
+    )
+    # From here on, there is one row per distinct failing filepath
+    normalized = pd.Series([_normalize_path(path) for path in paths], dtype=object)
+    parts = normalized.str.rpartition("/")
+    df["filepath"] = paths.to_numpy()[df["path_code"]]
+    df["pattern"] = normalized.to_numpy()[df["path_code"]]
+    df["dir"] = parts[0].to_numpy()[df["path_code"]]
+    df["file"] = parts[2].to_numpy()[df["path_code"]]
+    probed = df.groupby(["executable", "syscall", "error", "file"])["dir"].transform(
+        "nunique"
+    )
+    df.loc[probed > 1, "pattern"] = "*/" + df.loc[probed > 1, "file"]
+    # The most frequent filepath of each cluster is shown as example
+    df = (
+        df.sort_values(["count"], ascending=False, kind="stable")
+        .groupby(["executable", "syscall", "error", "pattern"], sort=False)
+        .agg(
+            count=("count", "sum"),
+            syscall_time=("syscall_time", "sum"),
+            dirs=("dir", "nunique"),
+            example=("filepath", "first"),
+        )
+        .reset_index()
+    )
+    df["syscall_time"] = df["syscall_time"].round(6)
+    df = df[
+        [
+            "count",
+            "syscall_time",
+            "executable",
+            "syscall",
+            "error",
+            "pattern",
+            "dirs",
+            "example",
+        ]
+    ]
+    df = df_top(df, "count")
+    print_df(df, title=command_dict[current_func_name()][1])
+
+
+def latency(df_strace):
+    """
+    Syscall latency per executable and syscall: count of syscalls, and the
+    total, mean, and max syscall time
+    """
+    df = latency_result(latency_partial(df_strace))
+    df = df_top(df, "total_time")
+    print_df(df, title=command_dict[current_func_name()][1])
+
+
+def latency_partial(df_strace):
+    """
+    Return the additive latency aggregates per executable and syscall: count
+    of syscalls, count of syscalls with syscall time, total and max time.
+    Aggregates from more than one strace log are merged with sum, except
+    'max_time', which is merged with max.
+    """
+    df = pd.DataFrame(
+        {
+            "executable": df_strace["executable"],
+            "syscall": df_strace["syscall"],
+            "syscall_time": pd.to_numeric(df_strace["syscall_time"], errors="coerce"),
+        }
+    )
+    return (
+        df.groupby(["executable", "syscall"])
+        .agg(
+            count=("syscall_time", "size"),
+            timed=("syscall_time", "count"),
+            total_time=("syscall_time", "sum"),
+            max_time=("syscall_time", "max"),
+        )
+        .reset_index()
+    )
+
+
+def latency_result(df):
+    """Return the latency output given the aggregates from latency_partial"""
+    df = df.copy()
+    df["mean_time"] = df["total_time"] / df["timed"]
+    df = df[["count", "total_time", "mean_time", "max_time", "executable", "syscall"]]
+    return df.round({"total_time": 6, "mean_time": 6, "max_time": 6})
+
+
+def lifecycle(df_strace, df_events=None):
+    """
+    Process lifecycle per executable: count of processes and threads, how
+    they ended, their exit codes and the signals that killed them, the mean
+    and max time from spawn to exit, and the count of signals delivered
+    """
+    if df_events is None:
+        df_events = no_events_frame()
+    df = lifecycle_result(lifecycle_partial(df_strace), df_events)
+    print_df(lifecycle_summary(df), title=command_dict[current_func_name()][1])
+    print_df(df, title="Process lifecycle per pid")
+
+
+def no_events_frame():
+    """
+    Return empty process events dataframe for a strace log that has no
+    events, and warn that how the processes ended is unknown
+    """
+    _LOGGER.warning(
+        "No process events in the strace log, how the processes ended is "
+        "unknown. Strace logs converted before strace2csv.py wrote the "
+        "events need to be converted again."
+    )
+    return pd.DataFrame(columns=EVENT_COLUMNS)
+
+
+def lifecycle_partial(df_strace):
+    """
+    Return the per-pid aggregates of command 'lifecycle': the time the pid
+    was first seen, either making a syscall or as the return value of a
+    clone-family syscall, the parent pid, the count of syscalls, and the
+    last known executable. Aggregates of consecutive parts of one strace log
+    are merged with merge_lifecycle_partials.
+    """
+    seconds = df_timestamp_seconds(df_strace)
+    pid = df_strace["pid"].astype(str)
+    ret_int = df_strace["ret_int"].astype(str)
+    spawns = df_strace["syscall"].isin(SPAWN_SYSCALLS) & ret_int.str.fullmatch(
+        r"[1-9]\d*"
+    )
+    executable = df_strace["executable"].astype(str)
+    df = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "pid": pid,
+                    "first_seen": seconds,
+                    "parent": "",
+                    "syscalls": 1,
+                    "executable": executable.where(executable != ""),
+                }
+            ),
+            pd.DataFrame(
+                {
+                    "pid": ret_int[spawns],
+                    "first_seen": seconds[spawns],
+                    "parent": pid[spawns],
+                    "syscalls": 0,
+                    "executable": None,
+                }
+            ),
+        ],
+        ignore_index=True,
+    )
+    return merge_lifecycle_partials(df)
+
+
+def merge_lifecycle_partials(df):
+    """Merge the per-pid aggregates from lifecycle_partial in dataframe df"""
+    return (
+        df.groupby("pid", sort=False)
+        .agg(
+            first_seen=("first_seen", "min"),
+            parent=("parent", "max"),
+            syscalls=("syscalls", "sum"),
+            executable=("executable", "last"),
+        )
+        .reset_index()
+    )
+
+
+def lifecycle_result(df, df_events):
+    """
+    Return one row per pid given the aggregates from lifecycle_partial and
+    the process events: start time relative to the first pid, duration from
+    spawn to exit, and how the process ended. Column 'status' is 'exited',
+    'killed', 'detached', or empty if the process was still running when
+    the strace log ended.
+    """
+    events = df_events.astype(str).assign(seconds=df_timestamp_seconds(df_events))
+    ends = events[events["event"].isin(["exited", "killed"])]
+    ends = ends.drop_duplicates("pid", keep="last").set_index("pid")
+    detached = events.loc[events["event"] == "detached", "pid"].unique()
+    signals = events[events["event"] == "signal"].groupby("pid").size()
+    df = df.set_index("pid")
+    df = df.reindex(df.index.union(ends.index, sort=False))
+    end = ends["seconds"].reindex(df.index)
+    status = ends["event"].reindex(df.index).fillna("")
+    status = status.where((status != "") | ~df.index.isin(detached), "detached")
+    value = ends["value"].reindex(df.index).fillna("")
+    # Processes that only appear in the events started at their end
+    start = df["first_seen"].fillna(end)
+    executable = df["executable"].fillna(ends["executable"].reindex(df.index))
+    # Children that made no complete syscall run the program of the parent
+    executable = executable.fillna(df["parent"].map(executable.dropna()))
+    df = pd.DataFrame(
+        {
+            "pid": df.index,
+            "parent": df["parent"].fillna(""),
+            "executable": executable.fillna(""),
+            "t_start": (start - start.min()).round(6),
+            "duration": (end - start).round(6),
+            "status": status,
+            "exit_code": value.where(status == "exited", ""),
+            "killed_by": value.where(status == "killed", ""),
+            "core_dumped": ends["detail"].reindex(df.index) == "(core dumped)",
+            "signals": signals.reindex(df.index, fill_value=0),
+            "syscalls": df["syscalls"].fillna(0).astype("int64"),
+        }
+    )
+    return df.sort_values("t_start", kind="stable").reset_index(drop=True)
+
+
+def lifecycle_summary(df):
+    """Return the per-executable output of command 'lifecycle'"""
+    exited = df["status"] == "exited"
+    df = df.assign(
+        processes=1,
+        exited=exited,
+        exit_nonzero=exited & (df["exit_code"] != "0"),
+        killed=df["status"] == "killed",
+        running=df["status"] == "",
+    )
+    df_summary = df.groupby("executable").agg(
+        processes=("processes", "sum"),
+        exited=("exited", "sum"),
+        exit_nonzero=("exit_nonzero", "sum"),
+        killed=("killed", "sum"),
+        core_dumped=("core_dumped", "sum"),
+        running=("running", "sum"),
+        mean_duration=("duration", "mean"),
+        max_duration=("duration", "max"),
+        signals=("signals", "sum"),
+    )
+    df_summary["exit_codes"] = _value_counts_str(df[exited], "exit_code")
+    df_summary["killed_by"] = _value_counts_str(df[df["killed"]], "killed_by")
+    df_summary = df_summary.fillna({"exit_codes": "", "killed_by": ""})
+    df_summary = df_summary.round({"mean_duration": 6, "max_duration": 6})
+    return df_top(df_summary.reset_index(), "processes")
+
+
+def _value_counts_str(df, column):
+    # Per executable, the values of column with their counts, most frequent
+    # first, for instance '0 (12), 1 (3)'
+    counts = df.groupby(["executable", column]).size()
+    counts = counts.sort_values(ascending=False, kind="stable")
+    return counts.groupby(level="executable").apply(
+        lambda group: ", ".join(
+            "%s (%s)" % (value, count) for (_executable, value), count in group.items()
+        )
+    )
+
+
+def _normalize_path(path):
+    path = RE_NUMERIC_COMPONENT.sub("<N>", path)
+    return RE_NUMERIC_SUFFIX.sub("<N>", path)
+
+
+def query(df_strace, sql=None, connection=None, df_events=None):
+    """
+    Run SQL query on the strace log. The syscalls are in table 'syscalls',
+    the process events in table 'events'. If connection is None, df_strace
+    and df_events are first loaded to in-memory database.
+    """
+    if not sql:
+        _LOGGER.error("Command 'query' requires SQL query as argument")
+        return
+    if connection is None:
+        connection = sqlite3.connect(":memory:")
+        df_to_sqlite(df_strace, connection)
+        if df_events is not None:
+            df_to_sqlite(df_events, connection, table=EVENTS_TABLE)
+        set_read_only(connection)
+    df = df_from_sqlite(connection, sql)
+    print_df(df)
+
+
 ###############################################################################
 
 
@@ -143,26 +598,154 @@ command_dict = {
         "All device file accesses in chronological order, including "
         "both successful and failed syscalls",
     ),
+    "file_tree": (
+        file_tree,
+        "File accesses rolled up by directory, recursively: count of "
+        "syscalls, failed syscalls, and syscall time per directory "
+        "(see --path-prefix, --depth, --min-count)",
+    ),
+    "error_clusters": (
+        error_clusters,
+        "Failed syscalls grouped into clusters by normalized filepath, "
+        "with total syscall time and an example filepath per cluster",
+    ),
+    "latency": (
+        latency,
+        "Syscall latency per executable and syscall: count of syscalls, and "
+        "the total, mean, and max syscall time",
+    ),
+    "rate": (
+        rate,
+        "Syscall bursts: time buckets where the syscall count exceeds the "
+        "rolling baseline (see --bucket, --group-by, --rate-csv)",
+    ),
+    "lifecycle": (
+        lifecycle,
+        "Process lifecycle per executable: count of processes, exit codes, "
+        "crashes, signals delivered, and the mean and max time from spawn "
+        "to exit, followed by the lifecycle of each pid",
+    ),
+    "query": (
+        query,
+        "Run SQL query given as the last argument, for instance: "
+        'query "SELECT syscall, COUNT(*) FROM syscalls GROUP BY syscall"',
+    ),
+}
+
+# Commands whose results are sorted by count or time with df_top, which
+# option --top applies to
+top_commands = [
+    "summary",
+    "count_errors",
+    "count_files",
+    "count_device_files",
+    "error_clusters",
+    "latency",
+    "lifecycle",
+]
+
+# Conditions that select the rows each command needs when the strace log is
+# a SQLite database: selective commands use the indexes instead of reading
+# the full table. Commands not listed here read the full table.
+_EXEC_ROWS = "(syscall >= 'exec' AND syscall < 'exed')"
+_ERROR_ROWS = "(ret_int = '-1')"
+_FILE_ROWS = "(filepath > '')"
+_DEVICE_FILE_ROWS = (
+    "((filepath >= '/dev/' AND filepath < '/dev0') OR "
+    "(filepath >= '/sys/' AND filepath < '/sys0'))"
+)
+command_sql = {
+    "summary": "%s OR %s" % (_EXEC_ROWS, _ERROR_ROWS),
+    "programs_executed": _EXEC_ROWS,
+    "count_errors": _ERROR_ROWS,
+    "count_files": _FILE_ROWS,
+    "count_device_files": _DEVICE_FILE_ROWS,
+    "file_access": _FILE_ROWS,
+    "file_access_errors": "%s AND %s" % (_FILE_ROWS, _ERROR_ROWS),
+    "device_file_access": _DEVICE_FILE_ROWS,
+    "file_tree": "(all_filepaths <> '[]')",
+    "error_clusters": _ERROR_ROWS,
+    # 'query' runs directly in the database
+    "query": "0",
 }
 
 
 class StraceAnalyzer:
-    """Implements strace log analyzer"""
+    """
+    Implements strace log analyzer. The strace log is either a csv file,
+    or a SQLite database file (see strace2csv.py).
+    """
 
     def __init__(self, strace_csv):
         exit_unless_accessible(strace_csv)
-        self.df_strace = df_from_csv_file(strace_csv)
-
-    def analyze_command(self, command):
-        """Run the specified command"""
+        self.strace_csv = strace_csv
+        self.connection = None
+        self.df_strace = None
+        if is_sqlite_file(strace_csv):
+            self.connection = sqlite_connect(strace_csv)
+        else:
+            self.df_strace = df_from_csv_file(strace_csv)
+
+    def frame(self, command=None):
+        """Return dataframe with the syscalls command needs"""
+        if self.connection is None:
+            return self.df_strace
+        sql = "SELECT * FROM %s WHERE %s ORDER BY rowid" % (
+            SYSCALLS_TABLE,
+            command_sql.get(command, "1"),
+        )
+        return df_from_sqlite(self.connection, sql, dtype=str)
+
+    def events_frame(self):
+        """
+        Return dataframe with the process events, or None if the strace log
+        was converted without them
+        """
+        if self.connection is None:
+            name = events_file(self.strace_csv)
+            return df_from_csv_file(name) if os.path.isfile(name) else None
+        if not table_exists(self.connection, EVENTS_TABLE):
+            return None
+        sql = "SELECT * FROM %s ORDER BY rowid" % EVENTS_TABLE
+        return df_from_sqlite(self.connection, sql, dtype=str)
+
+    def analyze_command(self, command, **kwargs):
+        """
+        Run the specified command. Keyword arguments are passed to the
+        command function if it accepts them, the rest are ignored.
+        """
         command_tuple = command_dict.get(command)
         if command_tuple:
+            warn_unless_top_applies(command)
             func = command_tuple[0]
-            func(self.df_strace)
+            kwargs["connection"] = self.connection
+            # The events are only read for the commands that use them
+            if "df_events" in inspect.signature(func).parameters:
+                kwargs["df_events"] = self.events_frame()
+            func(self.frame(command), **_command_kwargs(func, kwargs))
         else:
             _LOGGER.error("Unknown command: '%s'", command)
 
 
+def warn_unless_top_applies(command):
+    """Warn if option --top is given to a command it does not apply to"""
+    if output_top() is not None and command not in top_commands:
+        _LOGGER.warning(
+            "Option --top does not apply to command '%s', only to: %s",
+            command,
+            ", ".join(top_commands),
+        )
+
+
+def _command_kwargs(func, kwargs):
+    params = inspect.signature(func).parameters
+    return {
+        key: value
+        for key, value in kwargs.items()
+        if key in params and value is not None
+    }
+
+
 ################################################################################
 
 
@@ -176,13 +759,6 @@ def _command_help():
     return ret + "\n"
 
 
-class _SmartFormatter(argparse.HelpFormatter):
-    def _split_lines(self, text, width):
-        if text.startswith("R|"):
-            return text[2:].splitlines()
-        return argparse.HelpFormatter._split_lines(self, text, width)
-
-
 def getargs():
     """Parse command line arguments"""
     desc = (
@@ -192,19 +768,98 @@ def getargs():
     )
     epil = "Example: ./%s strace.csv summary" % os.path.basename(__file__)
     parser = argparse.ArgumentParser(
-        description=desc, epilog=epil, formatter_class=_SmartFormatter
+        description=desc, epilog=epil, formatter_class=SmartFormatter
     )
 
-    helpstr = "path to strace log in csv format (output from strace2csv.py)"
-    parser.add_argument("STRACE_CSV", nargs=1, help=helpstr)
+    helpstr = (
+        "path to strace log in csv format or SQLite database "
+        "(output from strace2csv.py), or with --approx, also the strace log"
+    )
+    parser.add_argument("STRACE_CSV", nargs="?", help=helpstr)
 
     helpstr = "R|specify output details, one of the following strings:"
-    parser.add_argument("COMMAND", nargs=1, help=helpstr + _command_help())
+    parser.add_argument("COMMAND", nargs="?", help=helpstr + _command_help())
+
+    helpstr = "SQL query for command 'query'"
+    parser.add_argument("SQL", nargs="?", help=helpstr)
 
     helpstr = "set the verbose level between 0-3 (defaults to --verbose=1)"
     parser.add_argument("--verbose", help=helpstr, type=int, default=1)
 
-    return parser.parse_args()
+    add_output_arguments(parser)
+
+    group = parser.add_argument_group("approximate analysis options")
+    helpstr = (
+        "read the strace log once in chunks, and estimate the results "
+        "from sketches and a random sample of the syscalls of each pid, "
+        "which do not grow with the number of syscalls. STRACE_CSV may "
+        "also be the strace log, which is parsed without converting it first."
+    )
+    group.add_argument("--approx", help=helpstr, action="store_true")
+    helpstr = (
+        "number of syscalls in the random sample for the commands that run "
+        "on the sample (defaults to --sample-rows=100000)"
+    )
+    group.add_argument("--sample-rows", help=helpstr, type=int, default=100000)
+
+    group = parser.add_argument_group("daemon options")
+    helpstr = (
+        "run as resident daemon that answers commands as json over this Unix "
+        "socket, keeping the captures loaded in memory and caching the "
+        "results until the capture changes (see strace_daemon.py for the "
+        "protocol). STRACE_CSV and COMMAND are then given in the requests."
+    )
+    group.add_argument("--serve", help=helpstr, metavar="SOCKET")
+    helpstr = (
+        "memory budget in MB of the captures and results the daemon keeps, "
+        "the least recently used captures are evicted beyond it (defaults to "
+        "--memory-budget=2048)"
+    )
+    group.add_argument("--memory-budget", help=helpstr, type=int, default=2048)
+
+    group = parser.add_argument_group("options for command 'file_tree'")
+    helpstr = "show only this directory and the directories below it"
+    group.add_argument("--path-prefix", help=helpstr)
+    helpstr = "show directories down to this depth (defaults to --depth=3)"
+    group.add_argument("--depth", help=helpstr, type=int)
+    helpstr = (
+        "hide directories with less than this many syscalls "
+        "(defaults to --min-count=1)"
+    )
+    group.add_argument("--min-count", help=helpstr, type=int)
+
+    group = parser.add_argument_group("options for command 'rate'")
+    helpstr = "time bucket width in seconds (defaults to --bucket=1.0)"
+    group.add_argument("--bucket", help=helpstr, type=float)
+    helpstr = "count syscalls per bucket and per this column (defaults to syscall)"
+    group.add_argument("--group-by", help=helpstr, choices=RATE_GROUP_BY)
+    helpstr = (
+        "number of preceding buckets the rolling baseline is computed "
+        "from, at most %s (defaults to --baseline-window=10)" % RATE_BASELINE_WINDOW_MAX
+    )
+    group.add_argument("--baseline-window", help=helpstr, type=int)
+    helpstr = (
+        "flag buckets where the count is at least this many times the "
+        "baseline (defaults to --burst-factor=3.0)"
+    )
+    group.add_argument("--burst-factor", help=helpstr, type=float)
+    helpstr = "write the full time-series to this csv file"
+    group.add_argument("--rate-csv", help=helpstr)
+
+    args = parser.parse_args()
+    if args.bucket is not None and args.bucket <= 0:
+        parser.error("--bucket must be greater than 0")
+    if args.baseline_window is not None and not (
+        1 <= args.baseline_window <= RATE_BASELINE_WINDOW_MAX
+    ):
+        parser.error(
+            "--baseline-window must be between 1 and %s" % RATE_BASELINE_WINDOW_MAX
+        )
+    if args.serve and (args.STRACE_CSV or args.approx):
+        parser.error("--serve takes STRACE_CSV and COMMAND from the requests")
+    if not args.serve and not args.COMMAND:
+        parser.error("the following arguments are required: STRACE_CSV, COMMAND")
+    return args
 
 
 ################################################################################
@@ -214,8 +869,35 @@ def main():
     """main entry point"""
     args = getargs()
     setup_logging(args.verbose)
-    analyzer = StraceAnalyzer(args.STRACE_CSV[0])
-    analyzer.analyze_command(args.COMMAND[0])
+    setup_output_from_args(args)
+    if args.serve:
+        # strace_daemon builds on this module, so it is imported only here
+        # pylint: disable=import-outside-toplevel, cyclic-import
+        from stracepy.strace_daemon import AnalyzerDaemon
+
+        AnalyzerDaemon(args.memory_budget * 2**20).run(args.serve)
+        return
+    if args.approx:
+        # strace_approx builds on this module, so it is imported only here
+        # pylint: disable=import-outside-toplevel
+        from stracepy.strace_approx import ApproxAnalyzer
+
+        analyzer = ApproxAnalyzer(args.sample_rows)
+        analyzer.read(args.STRACE_CSV)
+    else:
+        analyzer = StraceAnalyzer(args.STRACE_CSV)
+    analyzer.analyze_command(
+        args.COMMAND,
+        sql=args.SQL,
+        path_prefix=args.path_prefix,
+        depth=args.depth,
+        min_count=args.min_count,
+        bucket=args.bucket,
+        group_by=args.group_by,
+        baseline_window=args.baseline_window,
+        burst_factor=args.burst_factor,
+        rate_csv=args.rate_csv,
+    )
 
 
 if __name__ == "__main__":
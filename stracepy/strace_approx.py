@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2021 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: MIT
+
+# pylint: disable=invalid-name, too-many-instance-attributes
+
+""" Approximate analysis of large strace logs in one streaming pass """
+
+import logging
+import math
+import os
+import re
+
+import pandas as pd
+
+from stracepy.sketches import HeavyHitters, HyperLogLog, StratifiedSample, TDigest
+from stracepy.strace_analyzer import (
+    command_dict,
+    programs_executed,
+    latency_partial,
+    latency_result,
+    lifecycle_partial,
+    lifecycle_result,
+    lifecycle_summary,
+    merge_lifecycle_partials,
+    no_events_frame,
+    warn_unless_top_applies,
+    _command_kwargs,
+    RE_DEVICE_FILE,
+)
+from stracepy.strace_db import (
+    df_to_sqlite_file,
+    is_sqlite_file,
+    sqlite_connect,
+    table_exists,
+    EVENTS_TABLE,
+    SYSCALLS_TABLE,
+)
+from stracepy.strace2csv import events_file, match_event, EVENT_COLUMNS
+from stracepy.utils import (
+    df_to_csv_file,
+    df_top,
+    exit_unless_accessible,
+    merge_partials,
+    print_df,
+    title_suffix,
+    LOGGER_NAME,
+)
+
+###############################################################################
+
+_LOGGER = logging.getLogger(LOGGER_NAME)
+
+# Strace log line up to the syscall arguments: pid, timestamp, and either
+# the syscall name of a 'resumed' line or the syscall name and '('
+RE_QUICK_SYSCALL = re.compile(
+    r"(?P<pid>\d+)\s+(?P<tstamp>[^ ]+)\s+"
+    r"(?:<\.\.\.\s+(?P<resumed>[0-9a-z_]+)\s+resumed>|(?P<syscall>[0-9a-z_]+)\()"
+)
+# Pid and timestamp of a line that has no syscall, for instance an event
+RE_QUICK_PID_TSTAMP = re.compile(r"(?P<pid>\d+)\s+(?P<tstamp>[^ ]+)\s+")
+# Rest of a complete or resumed line: arguments, return value, and time
+RE_QUICK_RESULT = re.compile(
+    r"(?P<args>.*)\)\s+=\s+(?P<ret_int>-?\d+|\?)(?P<ret_str>.*?)"
+    r"(?:<(?P<time>\d[^>]*)>)?$"
+)
+# Filepaths in '<>' or '""' that begin with '/', './', or '../'. Unlike
+# find_filepaths, this matches in linear time, so it needs no timeout.
+RE_QUICK_FILEPATH = re.compile(r"(?<=[<\"])\.{0,2}/[^<>\"\[\]|'*\\]{0,255}(?=[<>\"])")
+
+# Number of rows the sketches are updated with at a time
+CHUNK_ROWS = 100000
+
+# Maximum number of exec* syscalls kept for command 'programs_executed'
+EXEC_ROWS_MAX = 100000
+
+# Columns of the sampled rows
+SAMPLE_COLUMNS = [
+    "timestamp",
+    "pid",
+    "executable",
+    "syscall",
+    "filepath",
+    "all_filepaths",
+    "ret_int",
+    "ret_str",
+    "syscall_time",
+]
+
+# Quantiles of the syscall time in the 'latency' output
+LATENCY_QUANTILES = [0.5, 0.9, 0.99]
+
+###############################################################################
+
+
+class QuickParser:
+    """
+    Strace log parser for approximate analysis. Produces the same columns as
+    StraceParser at a fraction of the cost, but with less care: filepaths
+    are matched with RE_QUICK_FILEPATH instead of find_filepaths, lines that
+    do not parse are skipped instead of failing the parse, and the 'resumed'
+    lines only get the filepaths of the 'unfinished' arguments, not the
+    arguments themselves. The process events are collected in events, like
+    StraceParser does.
+    """
+
+    def __init__(self, strace_log):
+        self.strace_log = strace_log
+        self.lines_unparsed = 0
+        self.events = []
+        # Key: pid, Value: executable
+        self.exec_map = {}
+        # Key: (pid, syscall), Value: filepaths in the 'unfinished' arguments
+        self.unfinished = {}
+
+    def parse_chunks(self, chunk_rows=CHUNK_ROWS):
+        """Parse the strace log, yielding dataframes of chunk_rows rows"""
+        rows = []
+        with open(self.strace_log, "rb") as in_file:
+            for raw_line in in_file:
+                row = self.parse_line(raw_line.decode("utf-8", errors="replace"))
+                if row:
+                    rows.append(row)
+                    if len(rows) >= chunk_rows:
+                        yield pd.DataFrame(rows, columns=SAMPLE_COLUMNS)
+                        rows = []
+        yield pd.DataFrame(rows, columns=SAMPLE_COLUMNS)
+
+    def parse_line(self, line):
+        """Return the row of a complete or resumed line, or None"""
+        match = RE_QUICK_SYSCALL.match(line)
+        if not match:
+            self._parse_event(line)
+            return None
+        pid = match.group("pid")
+        end = match.end()
+        rest = line[end:].rstrip("\n")
+        syscall = match.group("syscall")
+        if syscall and rest.endswith("<unfinished ...>"):
+            self.unfinished[(pid, syscall)] = RE_QUICK_FILEPATH.findall(rest[:500])
+            return None
+        result = RE_QUICK_RESULT.match(rest)
+        if not result:
+            self._parse_event(line)
+            return None
+        ret_int = result.group("ret_int")
+        ret_str = result.group("ret_str")
+        filepaths = RE_QUICK_FILEPATH.findall(
+            result.group("args")[:500] + ret_str[:500]
+        )
+        if not syscall:
+            syscall = match.group("resumed")
+            filepaths = self.unfinished.pop((pid, syscall), []) + filepaths
+        filepaths = list(dict.fromkeys(filepaths))
+        filepath = filepaths[0] if filepaths else ""
+        return (
+            match.group("tstamp"),
+            pid,
+            self._executable(pid, syscall, filepath, ret_int),
+            syscall,
+            filepath,
+            str(filepaths),
+            ret_int,
+            ret_str.strip(),
+            result.group("time") or "",
+        )
+
+    def events_frame(self):
+        """Return the process events as dataframe"""
+        return pd.DataFrame(self.events, columns=EVENT_COLUMNS)
+
+    def _parse_event(self, line):
+        match = RE_QUICK_PID_TSTAMP.match(line)
+        if not match:
+            # Events without pid, from strace without -f, are not parsed
+            self.lines_unparsed += 1
+            return
+        end = match.end()
+        event, value, detail = match_event(line[end:].rstrip("\n"))
+        if not event:
+            self.lines_unparsed += 1
+            return
+        pid = match.group("pid")
+        if event == "detached":
+            self.unfinished.pop((pid, value), None)
+        self.events.append(
+            (
+                match.group("tstamp"),
+                pid,
+                self.exec_map.get(pid, ""),
+                event,
+                value,
+                detail,
+            )
+        )
+
+    def _executable(self, pid, syscall, filepath, ret_int):
+        # Same mapping as StraceParser._get_bin_file, without the checks
+        if ret_int == "?":
+            return ""
+        if ret_int.isdigit():
+            if syscall.startswith("exec"):
+                self.exec_map[pid] = filepath
+            elif syscall == "clone":
+                self.exec_map[ret_int] = self.exec_map.get(pid, "")
+        return self.exec_map.get(pid, "")
+
+
+class ApproxAnalyzer:
+    """
+    Approximate strace log analyzer. Reads the strace log once, in chunks,
+    and keeps only summaries of it:
+      - count-min sketches of the failed syscalls and of the file accesses,
+        with the keys that have the highest estimated counts (fixed size)
+      - HyperLogLog sketch of the distinct filepaths (fixed size)
+      - exact latency totals and a t-digest of the syscall time per
+        executable and syscall (grows with the executable and syscall pairs)
+      - uniform random sample of the syscalls of each pid (fixed size, but
+        at least one syscall of each pid)
+      - exact lifecycle aggregates per pid, and the process events (grow
+        with the pids and the events)
+    Commands that have no sketch run on the sample.
+    """
+
+    def __init__(self, sample_rows=100000, seed=0):
+        self.syscalls = 0
+        self.parser = None
+        self.errors = HeavyHitters(["executable", "syscall", "ret_str"])
+        self.files = HeavyHitters(["executable", "filepath"])
+        self.device_files = HeavyHitters(["executable", "filepath"])
+        self.filepaths = HyperLogLog()
+        self.latency = None
+        self.digests = {}
+        self.execs = []
+        self.exec_rows = 0
+        self.sample = StratifiedSample("pid", sample_rows, seed)
+        self.processes = None
+        self.events = None
+
+    def read(self, name):
+        """
+        Read strace log name: csv or SQLite database from strace2csv, or
+        else the strace log itself
+        """
+        exit_unless_accessible(name)
+        _LOGGER.info("Reading: %s", name)
+        if str(name).lower().endswith(".csv"):
+            chunks = pd.read_csv(
+                name, keep_default_na=False, dtype=str, chunksize=CHUNK_ROWS
+            )
+            if os.path.isfile(events_file(name)):
+                self.events = pd.read_csv(
+                    events_file(name), keep_default_na=False, dtype=str
+                )
+        elif is_sqlite_file(name):
+            connection = sqlite_connect(name)
+            chunks = pd.read_sql_query(
+                "SELECT * FROM %s ORDER BY rowid" % SYSCALLS_TABLE,
+                connection,
+                dtype=str,
+                chunksize=CHUNK_ROWS,
+            )
+            if table_exists(connection, EVENTS_TABLE):
+                self.events = pd.read_sql_query(
+                    "SELECT * FROM %s ORDER BY rowid" % EVENTS_TABLE,
+                    connection,
+                    dtype=str,
+                )
+        else:
+            self.read_strace_log(name)
+            return
+        for df in chunks:
+            self.add(df)
+        _LOGGER.info("%s", self.report())
+
+    def read_strace_log(self, name):
+        """Read strace log name with QuickParser"""
+        exit_unless_accessible(name)
+        _LOGGER.info("Parsing strace log: '%s'", name)
+        self.parser = QuickParser(name)
+        for df in self.parser.parse_chunks():
+            self.add(df)
+        self.events = self.parser.events_frame()
+        _LOGGER.info("%s", self.report())
+
+    def add(self, df):
+        """Update the summaries with the syscalls in dataframe df"""
+        if df.empty:
+            return
+        df = df[SAMPLE_COLUMNS].astype(str)
+        self.syscalls += len(df)
+        self.errors.add(df[df["ret_int"] == "-1"])
+        files = df[df["filepath"] != ""]
+        self.files.add(files)
+        self.filepaths.add(files["filepath"].unique())
+        device_files = files["filepath"].str.contains(RE_DEVICE_FILE, regex=True)
+        self.device_files.add(files[device_files])
+        self._add_latency(df)
+        self.processes = merge_lifecycle_partials(
+            pd.concat([self.processes, lifecycle_partial(df)], ignore_index=True)
+        )
+        execs = df[df["syscall"].str.startswith("exec")]
+        self.exec_rows += len(execs)
+        if len(execs) and sum(map(len, self.execs)) < EXEC_ROWS_MAX:
+            self.execs.append(execs)
+        self.sample.add(df)
+
+    def _add_latency(self, df):
+        keys = ["executable", "syscall"]
+        df_partial = latency_partial(df)
+        if self.latency is not None:
+            df_partial = merge_partials(pd.concat([self.latency, df_partial]), keys)
+        self.latency = df_partial
+        times = pd.to_numeric(df["syscall_time"], errors="coerce")
+        for key, values in times.groupby([df[key] for key in keys], sort=False):
+            self.digests.setdefault(key, TDigest()).add(values.to_numpy())
+
+    def sample_to_file(self, filename):
+        """
+        Output the sampled syscalls in the format given by filename extension,
+        like StraceParser.to_file
+        """
+        if is_sqlite_file(filename):
+            df_to_sqlite_file(self.sample_frame(), filename)
+            if self.events is not None:
+                df_to_sqlite_file(self.events, filename, table=EVENTS_TABLE)
+        else:
+            df_to_csv_file(self.sample_frame(), filename)
+            if self.events is not None and not self.events.empty:
+                df_to_csv_file(self.events, events_file(filename))
+
+    def sample_frame(self):
+        """Return the sampled syscalls with column 'weight'"""
+        df = self.sample.frame()
+        if df is None:
+            return pd.DataFrame(columns=SAMPLE_COLUMNS + ["weight"])
+        return df
+
+    def report(self):
+        """Return the description of the approximation and its error bounds"""
+        probability = 1 - math.exp(-self.errors.sketch.depth)
+        ret = (
+            "Approximate analysis of %s syscalls: ~%s distinct filepaths "
+            "(standard error %.1f%%). Counts exceed the true count by at most "
+            "the value in column 'error' with %.0f%% probability. Sample of %s "
+            "syscalls from %s pids."
+            % (
+                self.syscalls,
+                self.filepaths.count(),
+                100 * self.filepaths.relative_error(),
+                100 * probability,
+                len(self.sample_frame()),
+                len(self.sample.seen),
+            )
+        )
+        if self.parser and self.parser.lines_unparsed:
+            ret += " Skipped %s lines that did not parse." % self.parser.lines_unparsed
+        return ret
+
+    def analyze_command(self, command, **kwargs):
+        """
+        Run the specified command from the summaries if it has an approximate
+        version, otherwise run it on the sample
+        """
+        if command not in command_dict:
+            _LOGGER.error("Unknown command: '%s'", command)
+            return
+        warn_unless_top_applies(command)
+        if command in approx_command_dict:
+            # All results are marked, also the ones that happen to be exact
+            with title_suffix(" (approximate)"):
+                approx_command_dict[command](self)
+            return
+        # The commands do not know column 'weight', so their counts and
+        # durations are the ones of the sampled rows only
+        df_sample = self.sample_frame()
+        _LOGGER.warning(
+            "Command '%s' runs on a sample of %s syscalls and does not scale "
+            "its counts, see column 'weight' for the number of syscalls each "
+            "sampled row stands for",
+            command,
+            len(df_sample),
+        )
+        func = command_dict[command][0]
+        kwargs["df_events"] = self.events
+        suffix = " (sample of %s syscalls, counts not scaled)" % len(df_sample)
+        with title_suffix(suffix):
+            func(df_sample, **_command_kwargs(func, kwargs))
+
+
+###############################################################################
+
+
+def _title(command):
+    return command_dict[command][1]
+
+
+def approx_summary(analyzer):
+    """Summarize strace log file"""
+    approx_programs_executed(analyzer)
+    approx_count_errors(analyzer)
+
+
+def approx_programs_executed(analyzer):
+    """Programs executed, exact up to EXEC_ROWS_MAX exec* syscalls"""
+    if analyzer.exec_rows > EXEC_ROWS_MAX:
+        _LOGGER.warning(
+            "Showing %s of %s exec* syscalls", EXEC_ROWS_MAX, analyzer.exec_rows
+        )
+    if analyzer.execs:
+        programs_executed(pd.concat(analyzer.execs)[:EXEC_ROWS_MAX])
+
+
+def approx_count_errors(analyzer):
+    """Count of failed syscalls"""
+    df = df_top(analyzer.errors.result(), "count")
+    print_df(df, title=_title("count_errors"))
+
+
+def approx_count_files(analyzer):
+    """Count of file accesses"""
+    df = df_top(analyzer.files.result(), "count")
+    print_df(df, title=_title("count_files"))
+
+
+def approx_count_device_files(analyzer):
+    """Count of device file accesses"""
+    df = df_top(analyzer.device_files.result(), "count")
+    print_df(df, title=_title("count_device_files"))
+
+
+def approx_latency(analyzer):
+    """
+    Syscall latency: exact count, total, mean, and max syscall time, and
+    quantiles of the syscall time estimated with t-digest
+    """
+    if analyzer.latency is None:
+        return
+    df = latency_result(analyzer.latency)
+    digests = [
+        analyzer.digests.get((executable, syscall), TDigest())
+        for executable, syscall in zip(df["executable"], df["syscall"])
+    ]
+    for q in LATENCY_QUANTILES:
+        column = "p%d_time" % round(100 * q)
+        df.insert(
+            len(df.columns) - 2,
+            column,
+            [round(digest.quantile(q), 6) for digest in digests],
+        )
+    df = df_top(df, "total_time")
+    print_df(df, title=_title("latency"))
+
+
+def approx_lifecycle(analyzer):
+    """Process lifecycle, exact: the per-pid aggregates are kept in full"""
+    if analyzer.processes is None:
+        return
+    df_events = analyzer.events
+    if df_events is None:
+        df_events = no_events_frame()
+    df = lifecycle_result(analyzer.processes, df_events)
+    print_df(lifecycle_summary(df), title=_title("lifecycle"))
+    print_df(df, title="Process lifecycle per pid")
+
+
+# Commands computed from the summaries, the other commands run on the sample
+approx_command_dict = {
+    "summary": approx_summary,
+    "programs_executed": approx_programs_executed,
+    "count_errors": approx_count_errors,
+    "count_files": approx_count_files,
+    "count_device_files": approx_count_device_files,
+    "latency": approx_latency,
+    "lifecycle": approx_lifecycle,
+}
+
+
+################################################################################
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2021 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: MIT
+
+# pylint: disable=invalid-name, too-few-public-methods
+
+"""
+Resident strace_analyzer daemon: keeps the captures loaded in memory and
+answers strace_analyzer commands over a Unix socket.
+
+The protocol is one json object per line in both directions. A request
+names the capture (csv or SQLite database, relative to the working
+directory of the daemon) and the command, and optionally the command
+arguments and the output slice:
+
+    {"capture": "/data/strace.csv", "command": "file_tree",
+     "args": {"path_prefix": "/etc", "depth": 2}, "top": 10}
+
+The response has the results of the command, one object per result table:
+
+    {"ok": true, "cached": false, "messages": [],
+     "results": [{"title": "...", "columns": [...], "data": [[...], ...]}]}
+
+Request {"command": "#stats"} returns the daemon counters instead.
+"""
+
+import asyncio
+import collections
+import json
+import logging
+import os
+import signal
+import socket
+import time
+
+from stracepy.strace_analyzer import (
+    StraceAnalyzer,
+    RATE_BASELINE_WINDOW_MAX,
+    RATE_GROUP_BY,
+)
+from stracepy.strace2csv import events_file
+from stracepy.utils import collect_output, setup_output, LOGGER_NAME
+
+###############################################################################
+
+_LOGGER = logging.getLogger(LOGGER_NAME)
+
+# Request that returns the daemon counters instead of running a command
+STATS_COMMAND = "#stats"
+
+# Maximum length of a request line
+LINE_LIMIT = 2**20
+
+###############################################################################
+
+
+def _is_str(value):
+    return isinstance(value, str)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_positive_number(value):
+    return _is_number(value) and value > 0
+
+
+def _is_int_at_least(minimum, maximum=None):
+    def check(value):
+        if not _is_number(value) or not isinstance(value, int):
+            return False
+        return value >= minimum and (maximum is None or value <= maximum)
+
+    return check
+
+
+# Command arguments a request may set: the same as the strace_analyzer
+# command line options, except the options that write files. Value is the
+# check that the argument value is valid, as the command line parser would.
+REQUEST_ARGS = {
+    "sql": _is_str,
+    "path_prefix": _is_str,
+    "depth": _is_int_at_least(0),
+    "min_count": _is_int_at_least(0),
+    "bucket": _is_positive_number,
+    "group_by": lambda value: value in RATE_GROUP_BY,
+    "baseline_window": _is_int_at_least(1, RATE_BASELINE_WINDOW_MAX),
+    "burst_factor": _is_number,
+}
+
+# Output options a request may set, see setup_output
+REQUEST_OUTPUT = {
+    "limit": _is_int_at_least(0),
+    "offset": _is_int_at_least(0),
+    "top": _is_int_at_least(0),
+}
+
+
+def invalid_options(options, checks):
+    """
+    Return the names of the options whose value is not valid given checks,
+    the dictionary from option name to the check of its value. Value None
+    means the default.
+    """
+    return [
+        name
+        for name, value in options.items()
+        if value is not None and not checks[name](value)
+    ]
+
+
+###############################################################################
+
+
+class _MessageCollector(logging.Handler):
+    """Collects the warnings and errors logged while running a command"""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages = []
+        self.errors = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+        if record.levelno >= logging.ERROR:
+            self.errors.append(record.getMessage())
+
+    @property
+    def failed(self):
+        """True if an error was logged"""
+        return bool(self.errors)
+
+
+def capture_signature(name):
+    """
+    Return the size and modification time of capture name and of its events
+    file, which change when the capture is converted again
+    """
+    signature = []
+    for path in [name, events_file(name)]:
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            signature += [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+
+class WarmCapture:
+    """Capture loaded in memory, and the cached results of its commands"""
+
+    def __init__(self, name):
+        self.name = name
+        self.signature = capture_signature(name)
+        self.analyzer = StraceAnalyzer(name)
+        self.frame_bytes = 0
+        if self.analyzer.df_strace is not None:
+            self.frame_bytes = int(
+                self.analyzer.df_strace.memory_usage(deep=True).sum()
+            )
+        # Key: request, Value: (results, messages logged by the command)
+        self.results = {}
+        self.result_bytes = 0
+        self.hits = 0
+
+    def size(self):
+        """Return the approximate memory use in bytes"""
+        return self.frame_bytes + self.result_bytes
+
+    def stats(self):
+        """Return the counters of the capture"""
+        return {
+            "frame_bytes": self.frame_bytes,
+            "result_bytes": self.result_bytes,
+            "results": len(self.results),
+            "hits": self.hits,
+        }
+
+
+class AnalyzerDaemon:
+    """
+    Answers strace_analyzer commands on captures kept in memory. The
+    captures and their cached results are evicted least recently used first
+    when their memory use exceeds memory_budget bytes, but the capture of
+    the current request is always kept. A capture whose file changed is
+    loaded again. Requests are served one at a time in the event loop
+    thread, so the commands run the same way as in strace_analyzer.
+    """
+
+    def __init__(self, memory_budget=2**31):
+        self.memory_budget = memory_budget
+        self.captures = collections.OrderedDict()
+        self.counters = collections.Counter()
+
+    def capture(self, name):
+        """Return the WarmCapture of capture name, loading it if needed"""
+        key = os.path.realpath(name)
+        capture = self.captures.get(key)
+        if capture is not None and capture.signature != capture_signature(key):
+            _LOGGER.info("Capture changed: %s", key)
+            del self.captures[key]
+            capture = None
+        if capture is None:
+            capture = WarmCapture(key)
+            self.captures[key] = capture
+            self.counters["loads"] += 1
+        self.captures.move_to_end(key)
+        return capture
+
+    def memory_use(self):
+        """Return the approximate memory use of the captures in bytes"""
+        return sum(capture.size() for capture in self.captures.values())
+
+    def _evict(self):
+        while len(self.captures) > 1 and self.memory_use() > self.memory_budget:
+            name, _capture = self.captures.popitem(last=False)
+            self.counters["evictions"] += 1
+            _LOGGER.info("Evicted capture: %s", name)
+
+    def handle_request(self, request):
+        """Return the response to request, both as dictionaries"""
+        self.counters["requests"] += 1
+        if request.get("command") == STATS_COMMAND:
+            return self.stats()
+        collector = _MessageCollector()
+        _LOGGER.addHandler(collector)
+        try:
+            response = self._run(request, collector)
+        except SystemExit:
+            # The analyzer exits on files it can not read and failed queries,
+            # which were logged as the reason
+            if not collector.failed:
+                _LOGGER.error("Command failed")
+            response = {"cached": False, "results": []}
+        except Exception as ex:  # pylint: disable=broad-exception-caught
+            # A failing command must not take the daemon down
+            _LOGGER.error("Command failed: %s: %s", type(ex).__name__, ex)
+            response = {"cached": False, "results": []}
+        finally:
+            _LOGGER.removeHandler(collector)
+        self._evict()
+        response["ok"] = not collector.failed
+        response["messages"] = response.get("messages", []) + collector.messages
+        if collector.failed:
+            response["error"] = collector.errors[0]
+        return response
+
+    def _run(self, request, collector):
+        name = request.get("capture")
+        command = request.get("command")
+        if not name or not command or not _is_str(name) or not _is_str(command):
+            _LOGGER.error("Request requires 'capture' and 'command' strings")
+            return {"cached": False, "results": []}
+        if not os.path.isfile(name):
+            _LOGGER.error("Capture not found: %s", name)
+            return {"cached": False, "results": []}
+        args = request.get("args") or {}
+        if not isinstance(args, dict):
+            _LOGGER.error("Request 'args' is not a json object")
+            return {"cached": False, "results": []}
+        args = {key: value for key, value in args.items() if key in REQUEST_ARGS}
+        output = {key: request.get(key) for key in REQUEST_OUTPUT}
+        invalid = invalid_options(args, REQUEST_ARGS)
+        invalid += invalid_options(output, REQUEST_OUTPUT)
+        if invalid:
+            _LOGGER.error("Invalid value for: %s", ", ".join(invalid))
+            return {"cached": False, "results": []}
+        capture = self.capture(name)
+        key = json.dumps([command, args, output], sort_keys=True)
+        cached = capture.results.get(key)
+        if cached is not None:
+            capture.hits += 1
+            self.counters["cache_hits"] += 1
+            results, messages = cached
+            return {"cached": True, "results": results, "messages": messages}
+        setup_output(limit=output["limit"], offset=output["offset"], top=output["top"])
+        with collect_output() as collected:
+            capture.analyzer.analyze_command(command, **args)
+        results = [
+            {"title": title, **json.loads(df.to_json(orient="split", index=False))}
+            for title, df in collected
+        ]
+        if not collector.failed:
+            capture.results[key] = (results, list(collector.messages))
+            capture.result_bytes += len(json.dumps(results))
+        return {"cached": False, "results": results}
+
+    def stats(self):
+        """Return the daemon counters"""
+        return {
+            "ok": True,
+            "memory_bytes": self.memory_use(),
+            "memory_budget": self.memory_budget,
+            "requests": self.counters["requests"],
+            "cache_hits": self.counters["cache_hits"],
+            "loads": self.counters["loads"],
+            "evictions": self.counters["evictions"],
+            "captures": {
+                name: capture.stats() for name, capture in self.captures.items()
+            },
+        }
+
+    async def handle_connection(self, reader, writer):
+        """Answer the requests of one connection, one response line each"""
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    _LOGGER.error("Request longer than %s bytes", LINE_LIMIT)
+                    return
+                if not line:
+                    return
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request is not a json object")
+                except ValueError as ex:
+                    response = {"ok": False, "messages": ["Invalid request: %s" % ex]}
+                else:
+                    response = self.handle_request(request)
+                writer.write((json.dumps(response) + "\n").encode("utf-8"))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, unix_path):
+        """Serve on Unix socket unix_path until SIGINT or SIGTERM"""
+        # Requests can run SQL queries on the captures: the socket is
+        # created accessible to the owner only
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(
+                self.handle_connection, path=unix_path, limit=LINE_LIMIT
+            )
+        finally:
+            os.umask(umask)
+        _LOGGER.info("Listening on: %s", unix_path)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(signum, stop.set)
+        await stop.wait()
+        server.close()
+        await server.wait_closed()
+        if os.path.exists(unix_path):
+            os.remove(unix_path)
+
+    def run(self, unix_path):
+        """Run the daemon on Unix socket unix_path"""
+        asyncio.run(self.serve(unix_path))
+
+
+def daemon_request(unix_path, request, timeout=0):
+    """
+    Send request to the daemon listening on Unix socket unix_path, and
+    return the response. If the daemon is not listening yet, retry
+    connecting for timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(str(unix_path))
+            break
+        except (FileNotFoundError, ConnectionRefusedError):
+            sock.close()
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.1)
+    with sock:
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        with sock.makefile("rb") as in_file:
+            return json.loads(in_file.readline())
+
+
+################################################################################
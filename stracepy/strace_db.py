@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2021 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: MIT
+
+# pylint: disable=invalid-name
+
+""" Store and query strace logs in SQLite database """
+
+import os
+import sys
+import sqlite3
+import logging
+from urllib.request import pathname2url
+
+import pandas as pd
+
+from stracepy.utils import LOGGER_NAME
+
+###############################################################################
+
+_LOGGER = logging.getLogger(LOGGER_NAME)
+
+SQLITE_EXTENSIONS = [".db", ".sqlite", ".sqlite3"]
+
+# Name of the table that stores the syscalls
+SYSCALLS_TABLE = "syscalls"
+
+# Name of the table that stores the process events, see strace2csv.py
+EVENTS_TABLE = "events"
+
+# Columns that get an index, if the table has such column
+INDEXED_COLUMNS = ["pid", "syscall", "executable", "filepath", "timestamp", "ret_int"]
+
+# Number of rows inserted with one executemany call
+INSERT_CHUNK_ROWS = 100000
+
+# Actions a read-only connection authorizes, see set_read_only
+READ_ONLY_ACTIONS = frozenset(
+    [
+        sqlite3.SQLITE_SELECT,
+        sqlite3.SQLITE_READ,
+        sqlite3.SQLITE_FUNCTION,
+        sqlite3.SQLITE_RECURSIVE,
+    ]
+)
+
+###############################################################################
+
+
+def is_sqlite_file(name):
+    """Return True if name has one of the SQLite database file extensions"""
+    return os.path.splitext(str(name))[1].lower() in SQLITE_EXTENSIONS
+
+
+def sqlite_connect(name):
+    """Open SQLite database name read-only, see set_read_only"""
+    _LOGGER.info("Reading: %s", name)
+    uri = "file:%s?mode=ro" % pathname2url(os.path.abspath(name))
+    try:
+        conn = sqlite3.connect(uri, uri=True)
+        conn.execute("SELECT name FROM sqlite_master LIMIT 1")
+    except sqlite3.DatabaseError:
+        _LOGGER.fatal("Not a SQLite database: '%s'", name)
+        sys.exit(1)
+    set_read_only(conn)
+    return conn
+
+
+def set_read_only(conn):
+    """
+    Make SQLite connection conn read-only: only SELECT statements are
+    authorized, so queries can not change the database or attach other
+    database files, which would create them
+    """
+    conn.execute("PRAGMA query_only = ON")
+    conn.set_authorizer(_authorize_read)
+
+
+def _authorize_read(action, _arg1, _arg2, _db_name, _trigger):
+    if action in READ_ONLY_ACTIONS:
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+
+def df_to_sqlite(df, conn, table=SYSCALLS_TABLE, append=False):
+    """
+    Insert dataframe rows to table in SQLite connection conn in one
+    transaction. Unless append is True, the table is first re-created.
+    All columns are stored as TEXT, the same way strace_analyzer reads csv.
+    """
+    columns = ", ".join('"%s" TEXT' % col for col in df.columns)
+    placeholders = ", ".join("?" * len(df.columns))
+    with conn:
+        if not append:
+            conn.execute('DROP TABLE IF EXISTS "%s"' % table)
+        conn.execute('CREATE TABLE IF NOT EXISTS "%s" (%s)' % (table, columns))
+        insert = 'INSERT INTO "%s" VALUES (%s)' % (table, placeholders)
+        for start in range(0, len(df), INSERT_CHUNK_ROWS):
+            chunk = df.iloc[start:][:INSERT_CHUNK_ROWS]
+            conn.executemany(insert, chunk.itertuples(index=False, name=None))
+        # Indexes are created after the bulk insert, which is faster than
+        # updating them on every insert
+        for col in INDEXED_COLUMNS:
+            if col in df.columns:
+                conn.execute(
+                    'CREATE INDEX IF NOT EXISTS "%s_%s" ON "%s" ("%s")'
+                    % (table, col, table, col)
+                )
+
+
+def df_to_sqlite_file(df, name, table=SYSCALLS_TABLE, append=False):
+    """Write dataframe to table in SQLite database file name"""
+    conn = sqlite3.connect(name)
+    try:
+        df_to_sqlite(df, conn, table, append)
+    finally:
+        conn.close()
+    _LOGGER.info("Wrote: %s", name)
+
+
+def df_from_sqlite(conn, sql, params=(), dtype=None):
+    """Run SQL query in connection conn and return the result as dataframe"""
+    try:
+        cursor = conn.execute(sql, params)
+        rows = cursor.fetchall()
+    except sqlite3.Error as ex:
+        _LOGGER.fatal("Query failed: %s", ex)
+        sys.exit(1)
+    if cursor.description is None:
+        _LOGGER.error("Query failed: statement returns no rows")
+        sys.exit(1)
+    df = pd.DataFrame(rows, columns=[col[0] for col in cursor.description])
+    return df if dtype is None else df.astype(dtype)
+
+
+def table_exists(conn, table):
+    """Return True if table exists in SQLite connection conn"""
+    sql = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+    return conn.execute(sql, (table,)).fetchone() is not None
+
+
+################################################################################
@@ -0,0 +1,651 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2021 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: MIT
+
+# pylint: disable=invalid-name, too-few-public-methods
+
+"""
+Differential testing of the strace log parsing engines. Generated and fuzzed
+strace logs are parsed with the reference parser and each other engine, the
+parsed rows and events are compared, and the throughput of each engine is
+recorded, so that parser optimizations can be checked for correctness and
+speed on the same inputs.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from stracepy.strace2csv import (
+    StraceParser,
+    StraceParseError,
+    checkpoint_file,
+    convert_incremental,
+    events_file,
+    EVENT_COLUMNS,
+    OUTPUT_COLUMNS,
+)
+from stracepy.strace_approx import QuickParser
+from stracepy.strace_server import TargetStream
+from stracepy.utils import print_df, setup_logging, LOGGER_NAME
+
+###############################################################################
+
+_LOGGER = logging.getLogger(LOGGER_NAME)
+
+# Columns the lenient engines are compared on: they find filepaths with a
+# different heuristic, and parse some lines the reference parser skips
+LENIENT_COLUMNS = ["timestamp", "pid", "syscall", "ret_int", "syscall_time"]
+
+# Byte offsets where the incremental engine cuts the growing strace log, as
+# fractions of its size, so that most cuts fall in the middle of a line
+INCREMENTAL_CUTS = [0.13, 0.37, 0.5, 0.81, 1.0]
+
+# Rows per segment of the streaming engine
+STREAMING_SEGMENT_ROWS = 500
+
+EXECUTABLES = ["/usr/bin/app", "/usr/bin/helper", "/bin/sh", "/usr/lib/app/worker"]
+FILEPATHS = [
+    "/etc/ld.so.cache",
+    "/etc/passwd",
+    "/usr/lib/x86_64-linux-gnu/libc.so.6",
+    "/usr/share/locale/locale.alias",
+    "/home/user/.config/app/settings.json",
+    "/tmp/app-12345.lock",
+    "/dev/null",
+    "/dev/pts/0",
+    "/proc/self/maps",
+    "/sys/devices/system/cpu/online",
+    "./relative/file.txt",
+    "../parent/file with spaces.txt",
+]
+SIGNALS = ["SIGSEGV", "SIGKILL", "SIGTERM", "SIGABRT"]
+
+###############################################################################
+
+
+class StraceLogGenerator:
+    """
+    Generates strace logs that the reference parser accepts: a process tree
+    started by exec and clone, with unfinished and resumed syscalls
+    interleaved between the processes, failed syscalls, '?' returns, huge
+    arguments, process exits, kills, and signals, and syscalls detached at
+    the end of the log
+    """
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.time_us = 36000 * 10**6
+        self.next_pid = 1000
+        # Key: pid, Value: pending 'resumed' line, or None if the pid is idle
+        self.pending = {}
+        self.parents = {}
+        self.lines = []
+
+    def generate(self, lines):
+        """Return strace log of about lines lines as bytes"""
+        root = self._new_pid(None)
+        self._emit(
+            root,
+            'execve("%s", ["app"], 0x7ffc1e3a9b40 /* 24 vars */) = 0 <0.000321>'
+            % EXECUTABLES[0],
+        )
+        while len(self.lines) < lines and self.pending:
+            pid = self.rng.choice(sorted(self.pending))
+            resumed = self.pending[pid]
+            if resumed:
+                self.pending[pid] = None
+                self._emit(pid, resumed)
+            else:
+                self._step(pid)
+        # Detach from the processes that are still in a syscall
+        for pid in sorted(self.pending):
+            resumed = self.pending[pid]
+            if resumed:
+                syscall = resumed.split()[1]
+                self._emit(pid, "<... %s resumed> <detached ...>" % syscall)
+        return "".join(line + "\n" for line in self.lines).encode("utf-8")
+
+    def _new_pid(self, parent):
+        pid = self.next_pid
+        self.next_pid += self.rng.randint(1, 30)
+        self.pending[pid] = None
+        self.parents[pid] = parent
+        return pid
+
+    def _emit(self, pid, rest):
+        self.time_us += self.rng.randint(1, 2000)
+        seconds, us = divmod(self.time_us, 10**6)
+        timestamp = "%02d:%02d:%02d.%06d" % (
+            seconds // 3600 % 24,
+            seconds // 60 % 60,
+            seconds % 60,
+            us,
+        )
+        self.lines.append("%s %s %s" % (pid, timestamp, rest))
+
+    def _duration(self):
+        return "<%.6f>" % (self.rng.expovariate(10000) + 0.000001)
+
+    def _step(self, pid):
+        choice = self.rng.random()
+        path = self.rng.choice(FILEPATHS)
+        if choice < 0.03 and len(self.pending) < 20:
+            child = self._new_pid(pid)
+            flags = self.rng.choice(["SIGCHLD", "CLONE_VM|CLONE_THREAD|SIGCHLD"])
+            self._emit(
+                pid,
+                "clone(child_stack=NULL, flags=%s, child_tidptr=0x7f12) = %s %s"
+                % (flags, child, self._duration()),
+            )
+        elif choice < 0.05:
+            exe = self.rng.choice(EXECUTABLES)
+            self._emit(
+                pid,
+                'execve("%s", ["%s", "--flag"], 0x7ffd /* 3 vars */) = 0 %s'
+                % (exe, os.path.basename(exe), self._duration()),
+            )
+        elif choice < 0.07 and self.parents[pid] is not None:
+            self._end(pid)
+        elif choice < 0.25:
+            # Unfinished syscall, resumed after the other pids had their turn
+            syscall = self.rng.choice(["read", "wait4", "poll", "futex"])
+            self._emit(pid, "%s(3<%s>,  <unfinished ...>" % (syscall, path))
+            self.pending[pid] = '<... %s resumed>"data", 4096) = %s %s' % (
+                syscall,
+                self.rng.choice(["12", "0", "-1 EINTR (Interrupted system call)"]),
+                self._duration(),
+            )
+        elif choice < 0.35:
+            self._emit(
+                pid,
+                'openat(AT_FDCWD, "%s", O_RDONLY|O_CLOEXEC) = -1 ENOENT '
+                "(No such file or directory) %s" % (path, self._duration()),
+            )
+        elif choice < 0.38:
+            # Huge arguments, with escaped quotes and backslashes
+            size = self.rng.choice([2048, 10000, 100000])
+            data = ('x\\"y\\\\' * (size // 6 + 1))[:size]
+            self._emit(
+                pid,
+                'write(1</dev/pts/0>, "%s"..., %s) = %s %s'
+                % (data, size, size, self._duration()),
+            )
+        elif choice < 0.39:
+            # '?' return of a complete syscall, without syscall time
+            self._emit(pid, "rt_sigreturn({mask=[]}) = ?")
+        elif choice < 0.40:
+            self._emit(
+                pid,
+                "--- SIGALRM {si_signo=SIGALRM, si_code=SI_KERNEL} ---",
+            )
+        else:
+            fd = self.rng.randint(3, 30)
+            self._emit(
+                pid,
+                'openat(AT_FDCWD, "%s", O_RDONLY|O_CLOEXEC) = %s<%s> %s'
+                % (path, fd, path, self._duration()),
+            )
+            self._emit(pid, "close(%s<%s>) = 0 %s" % (fd, path, self._duration()))
+
+    def _end(self, pid):
+        parent = self.parents[pid]
+        if self.rng.random() < 0.7:
+            code = self.rng.choice([0, 0, 0, 1, 2, 127])
+            self._emit(pid, "exit_group(%s <unfinished ...>" % code)
+            self._emit(pid, "<... exit_group resumed>) = ?")
+            self._emit(pid, "+++ exited with %s +++" % code)
+            status = "si_code=CLD_EXITED, si_pid=%s, si_status=%s" % (pid, code)
+        else:
+            signal_name = self.rng.choice(SIGNALS)
+            core = " (core dumped)" if signal_name in ["SIGSEGV", "SIGABRT"] else ""
+            # The unfinished syscall of a killed process never resumes
+            self._emit(pid, "nanosleep({tv_sec=1, tv_nsec=0},  <unfinished ...>")
+            self._emit(pid, "+++ killed by %s%s +++" % (signal_name, core))
+            status = "si_code=CLD_KILLED, si_pid=%s, si_status=%s" % (pid, signal_name)
+        del self.pending[pid]
+        if parent in self.pending and not self.pending[parent]:
+            self._emit(parent, "--- SIGCHLD {si_signo=SIGCHLD, %s} ---" % status)
+        # Orphans are reparented to init, which is not traced
+        for child, child_parent in self.parents.items():
+            if child_parent == pid:
+                self.parents[child] = 0
+
+
+def generate_strace_log(seed, lines=2000):
+    """Return generated strace log of about lines lines as bytes"""
+    return StraceLogGenerator(seed).generate(lines)
+
+
+def fuzz_strace_log(data, seed, mutations=5):
+    """
+    Return strace log data with mutations random line-level mutations:
+    truncated, deleted, duplicated, swapped, and corrupted lines, corrupted
+    return values, and bytes that are not valid utf-8
+    """
+    rng = random.Random(seed)
+    lines = data.split(b"\n")[:-1]
+    for _ in range(mutations):
+        if not lines:
+            break
+        i = rng.randrange(len(lines))
+        line = lines[i]
+        mutation = rng.randrange(7)
+        if mutation == 0:
+            lines[i] = line[: rng.randrange(len(line) + 1)]
+        elif mutation == 1:
+            del lines[i]
+        elif mutation == 2:
+            lines.insert(i, line)
+        elif mutation == 3 and i + 1 < len(lines):
+            lines[i], lines[i + 1] = lines[i + 1], line
+        elif mutation == 4:
+            pos = rng.randrange(len(line) + 1)
+            char = bytes([rng.choice(b"()<>\"'\\,=?{} .:-0123456789ax")])
+            end = pos + 1
+            lines[i] = line[:pos] + char + line[end:]
+        elif mutation == 5 and b") = " in line:
+            pos = line.rindex(b") = ") + 4 + rng.randrange(3)
+            char = bytes([rng.choice(b"?-0123456789 <")])
+            lines[i] = line[:pos] + char + line[pos:]
+        else:
+            pos = rng.randrange(len(line) + 1)
+            lines[i] = line[:pos] + b"\xff\xfe\r" + line[pos:]
+    return b"".join(line + b"\n" for line in lines)
+
+
+###############################################################################
+
+
+def engine_reference(strace_log, _work_dir):
+    """Reference parser: StraceParser.parse over the whole strace log"""
+    parser = StraceParser(strace_log)
+    parser.parse()
+    return parser.entries.to_dataframe(), parser.events_frame()
+
+
+def _read_events(name):
+    # Csv output has no events file if there are no events
+    if not os.path.isfile(name):
+        return pd.DataFrame(columns=EVENT_COLUMNS)
+    return pd.read_csv(name, dtype=str, keep_default_na=False)
+
+
+def engine_incremental(strace_log, work_dir):
+    """
+    Incremental conversion (strace2csv --incremental) of the strace log as
+    it grows, cut at INCREMENTAL_CUTS, with the output read back from csv
+    """
+    with open(strace_log, "rb") as in_file:
+        data = in_file.read()
+    growing_log = os.path.join(work_dir, "incremental.log")
+    out = os.path.join(work_dir, "incremental.csv")
+    # The checkpoint of the previous input may match the head of this one
+    if os.path.exists(checkpoint_file(out)):
+        os.remove(checkpoint_file(out))
+    for cut in INCREMENTAL_CUTS:
+        with open(growing_log, "wb") as out_file:
+            out_file.write(data[: int(len(data) * cut)])
+        convert_incremental(StraceParser(growing_log), out)
+    return (
+        pd.read_csv(out, dtype=str, keep_default_na=False),
+        _read_events(events_file(out)),
+    )
+
+
+def engine_streaming(strace_log, work_dir):
+    """
+    Streaming parser of strace_server: one line at a time, taking a segment
+    every STREAMING_SEGMENT_ROWS rows. Lines that fail to parse are skipped
+    and counted, which is reported here as the error of the first such line.
+    """
+    target = TargetStream("difftest", work_dir, "csv")
+    frames = []
+    events = []
+    with open(strace_log, "rb") as in_file:
+        for raw_line in in_file:
+            target.parse_line(raw_line.decode("utf-8", errors="replace"))
+            if target.pending_rows() >= STREAMING_SEGMENT_ROWS:
+                _name, df, _events_name, df_events = target.take_segment()
+                frames.append(df)
+                events.append(df_events)
+    if target.parse_errors:
+        raise StraceParseError("%s lines failed to parse" % target.parse_errors)
+    _name, df, _events_name, df_events = target.take_segment()
+    return (
+        pd.concat(frames + [df], ignore_index=True),
+        pd.concat(events + [df_events], ignore_index=True),
+    )
+
+
+def engine_approx(strace_log, _work_dir):
+    """Quick parser of the approximate analysis (strace2csv --approx)"""
+    parser = QuickParser(strace_log)
+    df = pd.concat(list(parser.parse_chunks()), ignore_index=True)
+    return df, parser.events_frame()
+
+
+# Engine name: (function, True if the engine must give identical rows to
+# the reference parser, including failing on the same strace logs)
+engine_dict = {
+    "reference": (engine_reference, True),
+    "incremental": (engine_incremental, True),
+    "streaming": (engine_streaming, True),
+    "approx": (engine_approx, False),
+}
+
+
+###############################################################################
+
+
+def _normalize(df, columns):
+    df = df.reindex(columns=columns)
+    return df.astype(object).fillna("").astype(str).reset_index(drop=True)
+
+
+def compare_frames(df_ref, df, columns):
+    """
+    Return description of the first difference between dataframes df_ref
+    and df in columns, or None if they are identical
+    """
+    df_ref = _normalize(df_ref, columns)
+    df = _normalize(df, columns)
+    if len(df) != len(df_ref):
+        return "%s rows, expected %s" % (len(df), len(df_ref))
+    diff = np.argwhere(df.to_numpy() != df_ref.to_numpy())
+    if not diff.size:
+        return None
+    row, col = diff[0]
+    return "row %s column '%s': %r, expected %r" % (
+        row,
+        columns[col],
+        df.iat[row, col],
+        df_ref.iat[row, col],
+    )
+
+
+def run_engine(engine, strace_log, work_dir):
+    """
+    Run engine on strace_log. Return dictionary with the parsed syscalls
+    ('df') and events ('df_events'), the parse error if the engine rejected
+    the strace log ('error'), the unexpected exception if it crashed
+    ('crash'), and the run time ('seconds').
+    """
+    result = {"df": None, "df_events": None, "error": None, "crash": None}
+    start = time.perf_counter()
+    try:
+        result["df"], result["df_events"] = engine_dict[engine][0](strace_log, work_dir)
+    except StraceParseError as ex:
+        result["error"] = ex.args[0]
+    except Exception as ex:  # pylint: disable=broad-except
+        result["crash"] = "%s: %s" % (type(ex).__name__, ex)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def diff_engines(strace_log, engines, work_dir):
+    """
+    Run the reference parser and engines on strace_log. Return dictionary
+    with the result of each engine (see run_engine) and 'mismatch', the
+    description of how the engine differs from the reference, or None.
+    A crash is always a mismatch.
+    """
+    ref = run_engine("reference", strace_log, work_dir)
+    results = {"reference": ref}
+    ref["mismatch"] = ref["crash"]
+    for engine in engines:
+        if engine == "reference":
+            continue
+        result = run_engine(engine, strace_log, work_dir)
+        results[engine] = result
+        exact = engine_dict[engine][1]
+        result["mismatch"] = result["crash"]
+        if result["mismatch"] or ref["crash"]:
+            continue
+        if ref["error"] or result["error"]:
+            if exact and bool(ref["error"]) != bool(result["error"]):
+                result["mismatch"] = "parse error %r, expected %r" % (
+                    result["error"],
+                    ref["error"],
+                )
+            continue
+        if exact:
+            mismatch = compare_frames(ref["df"], result["df"], OUTPUT_COLUMNS)
+            if mismatch is None:
+                mismatch = compare_frames(
+                    ref["df_events"], result["df_events"], EVENT_COLUMNS
+                )
+            result["mismatch"] = mismatch
+        else:
+            # Recorded, but not a failure
+            result["agreement"] = compare_frames(
+                ref["df"], result["df"], LENIENT_COLUMNS
+            )
+    return results
+
+
+###############################################################################
+
+
+def corpus(seeds, lines, fuzz):
+    """
+    Yield (name, data) of the generated strace logs of seeds, and of fuzz
+    fuzzed variants of each
+    """
+    for seed in seeds:
+        data = generate_strace_log(seed, lines)
+        yield "generated-%s" % seed, data
+        for variant in range(fuzz):
+            fuzz_seed = seed * 1000 + variant
+            yield "fuzzed-%s" % fuzz_seed, fuzz_strace_log(data, fuzz_seed)
+
+
+class DiffTest:
+    """Runs the engines on the inputs, and collects mismatches and throughput"""
+
+    def __init__(self, engines, work_dir, save_failures=None):
+        self.engines = ["reference"] + [e for e in engines if e != "reference"]
+        self.work_dir = work_dir
+        self.save_failures = save_failures
+        self.failures = []
+
+    def run(self, name, strace_log):
+        """Run the engines on strace_log and record the mismatches"""
+        results = diff_engines(strace_log, self.engines, self.work_dir)
+        for engine, result in results.items():
+            if result["mismatch"]:
+                self.failures.append((name, engine, result["mismatch"]))
+                _LOGGER.error("%s: %s: %s", name, engine, result["mismatch"])
+                self._save(name, strace_log)
+        return results
+
+    def run_data(self, name, data):
+        """Run the engines on strace log given as bytes"""
+        strace_log = os.path.join(self.work_dir, "input.log")
+        with open(strace_log, "wb") as out_file:
+            out_file.write(data)
+        return self.run(name, strace_log)
+
+    def throughput(self, strace_log, repeat=3):
+        """
+        Return dataframe of the throughput of each engine on strace_log,
+        the best of repeat runs
+        """
+        size = os.path.getsize(strace_log)
+        with open(strace_log, "rb") as in_file:
+            lines = sum(1 for _ in in_file)
+        rows = []
+        for engine in self.engines:
+            results = [
+                run_engine(engine, strace_log, self.work_dir) for _ in range(repeat)
+            ]
+            seconds = min(result["seconds"] for result in results)
+            result = results[0]
+            rows.append(
+                {
+                    "engine": engine,
+                    "lines": lines,
+                    "rows": 0 if result["df"] is None else len(result["df"]),
+                    "seconds": round(seconds, 6),
+                    "lines_per_s": round(lines / seconds),
+                    "mb_per_s": round(size / seconds / 2**20, 3),
+                    "error": result["error"] or result["crash"] or "",
+                }
+            )
+        return pd.DataFrame(rows)
+
+    def _save(self, name, strace_log):
+        if not self.save_failures:
+            return
+        os.makedirs(self.save_failures, exist_ok=True)
+        name = os.path.join(self.save_failures, "%s.log" % name)
+        if not os.path.exists(name):
+            shutil.copyfile(strace_log, name)
+            _LOGGER.info("Wrote: %s", name)
+
+
+def throughput_regressions(df, baseline, max_slowdown):
+    """
+    Return descriptions of the engines whose throughput in dataframe df is
+    more than max_slowdown (a fraction) below the baseline throughput
+    """
+    ret = []
+    for engine, lines_per_s in zip(df["engine"], df["lines_per_s"]):
+        base = baseline.get(engine, {}).get("lines_per_s")
+        if base and lines_per_s < base * (1 - max_slowdown):
+            ret.append(
+                "%s: %s lines/s, baseline %s lines/s" % (engine, lines_per_s, base)
+            )
+    return ret
+
+
+################################################################################
+
+
+def getargs():
+    """Parse command line arguments"""
+    desc = (
+        "Differential testing of the strace log parsing engines. Parses "
+        "generated strace logs, fuzzed variants of them, and the given "
+        "STRACE_LOG files with the reference parser and the other engines, "
+        "fails if an exact engine parses different rows or events, or "
+        "if any engine crashes, and measures the throughput of each engine. "
+        "Engines: %s." % ", ".join(engine_dict)
+    )
+    epil = "Example: ./%s --seeds 20 --fuzz 10 --throughput-json perf.json" % (
+        os.path.basename(__file__)
+    )
+    parser = argparse.ArgumentParser(description=desc, epilog=epil)
+
+    helpstr = "strace logs to test in addition to the generated ones"
+    parser.add_argument("STRACE_LOG", nargs="*", help=helpstr)
+
+    helpstr = "engines to compare with the reference parser (defaults to all)"
+    parser.add_argument("--engines", nargs="+", choices=list(engine_dict))
+
+    helpstr = "number of generated strace logs (defaults to --seeds=10)"
+    parser.add_argument("--seeds", help=helpstr, type=int, default=10)
+
+    helpstr = "lines per generated strace log (defaults to --lines=2000)"
+    parser.add_argument("--lines", help=helpstr, type=int, default=2000)
+
+    helpstr = "fuzzed variants of each generated strace log (defaults to --fuzz=5)"
+    parser.add_argument("--fuzz", help=helpstr, type=int, default=5)
+
+    helpstr = "copy the inputs that fail to this directory"
+    parser.add_argument("--save-failures", help=helpstr)
+
+    group = parser.add_argument_group("throughput options")
+    helpstr = (
+        "lines of the generated strace log the throughput is measured on, "
+        "0 to skip the measurement (defaults to --perf-lines=100000)"
+    )
+    group.add_argument("--perf-lines", help=helpstr, type=int, default=100000)
+    helpstr = "write the throughput of each engine to this json file"
+    group.add_argument("--throughput-json", help=helpstr)
+    helpstr = (
+        "fail if the throughput of an engine is below the throughput in "
+        "this json file from --throughput-json by more than --max-slowdown"
+    )
+    group.add_argument("--baseline", help=helpstr)
+    helpstr = "allowed slowdown as fraction (defaults to --max-slowdown=0.25)"
+    group.add_argument("--max-slowdown", help=helpstr, type=float, default=0.25)
+
+    helpstr = "set the verbose level between 0-3 (defaults to --verbose=0)"
+    parser.add_argument("--verbose", help=helpstr, type=int, default=0)
+
+    return parser.parse_args()
+
+
+################################################################################
+
+
+def main():
+    """main entry point"""
+    args = getargs()
+    setup_logging(args.verbose)
+    if not args.verbose:
+        # The engines warn about the lines that fail to parse, which the
+        # fuzzed strace logs are full of
+        _LOGGER.setLevel(logging.ERROR)
+    work_dir = tempfile.mkdtemp(prefix="strace_difftest_")
+    try:
+        difftest = DiffTest(
+            args.engines or list(engine_dict), work_dir, args.save_failures
+        )
+        inputs = 0
+        for name, data in corpus(range(args.seeds), args.lines, args.fuzz):
+            difftest.run_data(name, data)
+            inputs += 1
+        for strace_log in args.STRACE_LOG:
+            difftest.run(strace_log, strace_log)
+            inputs += 1
+        print_df(
+            pd.DataFrame(difftest.failures, columns=["input", "engine", "mismatch"]),
+            title="Mismatches",
+        )
+        print("Tested %s inputs, %s mismatches" % (inputs, len(difftest.failures)))
+        failed = bool(difftest.failures)
+        if args.perf_lines:
+            strace_log = os.path.join(work_dir, "perf.log")
+            with open(strace_log, "wb") as out_file:
+                out_file.write(generate_strace_log(0, args.perf_lines))
+            df = difftest.throughput(strace_log)
+            print_df(df, title="Throughput")
+            if args.throughput_json:
+                with open(args.throughput_json, "w", encoding="utf-8") as out_file:
+                    json.dump(
+                        {row["engine"]: row for row in df.to_dict("records")},
+                        out_file,
+                        indent=2,
+                    )
+                print("Wrote: %s" % args.throughput_json)
+            if args.baseline:
+                with open(args.baseline, encoding="utf-8") as in_file:
+                    baseline = json.load(in_file)
+                for regression in throughput_regressions(
+                    df, baseline, args.max_slowdown
+                ):
+                    print("Throughput regression: %s" % regression)
+                    failed = True
+    finally:
+        shutil.rmtree(work_dir)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
+
+################################################################################
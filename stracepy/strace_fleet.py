@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2021 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: MIT
+
+# pylint: disable=invalid-name
+
+""" Aggregate strace_analyzer results over many strace logs in parallel """
+
+import argparse
+import glob
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import pandas as pd
+
+from stracepy.strace_analyzer import (
+    StraceAnalyzer,
+    count_errors_partial,
+    count_errors_result,
+    count_files_partial,
+    count_files_result,
+    latency_partial,
+    latency_result,
+)
+from stracepy.strace_db import SQLITE_EXTENSIONS
+from stracepy.utils import (
+    df_top,
+    merge_partials,
+    print_df,
+    setup_logging,
+    setup_output_from_args,
+    add_output_arguments,
+    wrap_text,
+    SmartFormatter,
+    LOGGER_NAME,
+    MERGE_AGGREGATES,
+)
+
+###############################################################################
+
+_LOGGER = logging.getLogger(LOGGER_NAME)
+
+# File extensions of the strace logs read from a directory
+CAPTURE_EXTENSIONS = [".csv"] + SQLITE_EXTENSIONS
+
+###############################################################################
+
+
+def _count_errors_result(df):
+    return df_top(count_errors_result(df), "count")
+
+
+def _count_files_result(df):
+    return df_top(count_files_result(df), "count")
+
+
+def _latency_result(df):
+    return df_top(latency_result(df), "total_time")
+
+
+###############################################################################
+
+# Commands that can be run over many strace logs. Each command has a function
+# that computes the partial aggregates from one strace log (map), the group
+# keys to merge the partial aggregates with (reduce), a function that returns
+# the output from the merged aggregates, and a description.
+fleet_command_dict = {
+    "count_errors": (
+        count_errors_partial,
+        ["executable", "syscall", "ret_str"],
+        _count_errors_result,
+        "Count of failed syscalls",
+    ),
+    "count_files": (
+        count_files_partial,
+        ["executable", "filepath"],
+        _count_files_result,
+        "Count of file accesses",
+    ),
+    "latency": (
+        latency_partial,
+        ["executable", "syscall"],
+        _latency_result,
+        "Syscall latency per executable and syscall: count of syscalls, and "
+        "the total, mean, and max syscall time",
+    ),
+}
+
+
+def find_captures(source):
+    """
+    Return the strace logs given source, which is a directory, a glob
+    pattern, or a single file
+    """
+    if os.path.isdir(source):
+        captures = [
+            os.path.join(source, name)
+            for name in os.listdir(source)
+            if os.path.splitext(name)[1].lower() in CAPTURE_EXTENSIONS
+        ]
+    elif glob.has_magic(source):
+        captures = glob.glob(source)
+    else:
+        captures = [source]
+    return sorted(captures)
+
+
+def _map_capture(command, capture):
+    # Runs in the worker process: only the partial aggregates of one strace
+    # log are returned to the parent process
+    analyzer = StraceAnalyzer(capture)
+    return capture, fleet_command_dict[command][0](analyzer.frame(command))
+
+
+class FleetAnalyzer:
+    """
+    Runs strace_analyzer commands over many strace logs in a process pool,
+    merging the partial aggregates from each strace log map-reduce style.
+    Each worker process holds one strace log in memory at a time, and the
+    parent process only holds the merged aggregates.
+    """
+
+    def __init__(self, captures, jobs=None):
+        self.captures = captures
+        self.jobs = jobs or os.cpu_count()
+
+    def analyze_command(self, command):
+        """Run the specified command"""
+        command_tuple = fleet_command_dict.get(command)
+        if not command_tuple:
+            _LOGGER.error("Unknown command: '%s'", command)
+            return
+        _func, _keys, result, desc = command_tuple
+        df_merged, df_breakdown = self.aggregate(command)
+        if df_merged is None:
+            return
+        print_df(result(df_merged), title=desc)
+        print_df(df_breakdown, title="Per-capture breakdown")
+
+    def aggregate(self, command):
+        """
+        Return the merged aggregates for command, and the per-capture
+        breakdown that has the totals of each strace log
+        """
+        keys = fleet_command_dict[command][1]
+        df_merged = None
+        breakdown = []
+        for capture, df_partial in self._map(command):
+            row = {"capture": capture, "groups": len(df_partial)}
+            for col in df_partial.columns:
+                if col not in keys:
+                    row[col] = df_partial[col].agg(MERGE_AGGREGATES[col])
+            breakdown.append(row)
+            if df_merged is not None:
+                df_partial = merge_partials(pd.concat([df_merged, df_partial]), keys)
+            df_merged = df_partial
+        return df_merged, pd.DataFrame(breakdown).round(6)
+
+    def _map(self, command):
+        _LOGGER.info("Analyzing %s strace logs", len(self.captures))
+        if self.jobs == 1:
+            yield from map(_map_capture, repeat(command), self.captures)
+            return
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            yield from executor.map(_map_capture, repeat(command), self.captures)
+
+
+################################################################################
+
+
+def _command_help():
+    ret = "\n"
+    for command, command_tuple in fleet_command_dict.items():
+        ret = ret + "\n%-10s:\n  %s\n" % (
+            "'" + command + "'",
+            wrap_text(command_tuple[3], lilen=50, indent="  "),
+        )
+    return ret + "\n"
+
+
+def getargs():
+    """Parse command line arguments"""
+    desc = (
+        "Run strace_analyzer commands over many strace logs in csv or SQLite "
+        "format (CAPTURES) in parallel, and merge the results into one "
+        "report with a per-capture breakdown."
+    )
+    epil = "Example: ./%s 'nightly/*.csv' count_errors" % os.path.basename(__file__)
+    parser = argparse.ArgumentParser(
+        description=desc, epilog=epil, formatter_class=SmartFormatter
+    )
+
+    helpstr = (
+        "directory that contains the strace logs, or glob pattern that "
+        "matches the strace logs (quote the pattern)"
+    )
+    parser.add_argument("CAPTURES", nargs=1, help=helpstr)
+
+    helpstr = "R|specify output details, one of the following strings:"
+    parser.add_argument("COMMAND", nargs=1, help=helpstr + _command_help())
+
+    helpstr = (
+        "number of strace logs analyzed in parallel, each one in its own "
+        "process (defaults to the number of CPUs)"
+    )
+    parser.add_argument("--jobs", help=helpstr, type=int)
+
+    helpstr = "set the verbose level between 0-3 (defaults to --verbose=1)"
+    parser.add_argument("--verbose", help=helpstr, type=int, default=1)
+
+    add_output_arguments(parser)
+
+    return parser.parse_args()
+
+
+################################################################################
+
+
+def main():
+    """main entry point"""
+    args = getargs()
+    setup_logging(args.verbose)
+    setup_output_from_args(args)
+    captures = find_captures(args.CAPTURES[0])
+    if not captures:
+        sys.stderr.write("Error: no strace logs found: %s\n" % args.CAPTURES[0])
+        sys.exit(1)
+    analyzer = FleetAnalyzer(captures, args.jobs)
+    analyzer.analyze_command(args.COMMAND[0])
+
+
+if __name__ == "__main__":
+    main()
+
+################################################################################
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2021 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: MIT
+
+# pylint: disable=invalid-name, too-many-instance-attributes
+
+""" Ingest strace output streamed over sockets from many targets """
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import signal
+import sys
+import time
+
+from stracepy.strace2csv import (
+    StraceParser,
+    StraceParseError,
+    ENCODED_COLUMNS,
+    ENCODED_EVENT_COLUMNS,
+)
+from stracepy.utils import (
+    ColumnStore,
+    df_to_csv_file,
+    df_to_parquet_file,
+    setup_logging,
+    LOGGER_NAME,
+    pyarrow,
+)
+
+###############################################################################
+
+_LOGGER = logging.getLogger(LOGGER_NAME)
+
+# First line of a stream that names the target: '#target <name>'
+TARGET_COMMAND = "#target"
+# First line of a stream that requests the live counters as json: '#stats'
+STATS_COMMAND = "#stats"
+
+# Maximum length of a line in the stream
+LINE_LIMIT = 2**20
+# Let other streams run after parsing this many lines from one stream
+LINES_PER_YIELD = 1000
+
+SEGMENT_WRITERS = {
+    "csv": df_to_csv_file,
+    "parquet": df_to_parquet_file,
+}
+
+###############################################################################
+
+
+class TargetStream:
+    """
+    Parser state, rolling output segments, and counters of one target. The
+    parser state is kept over reconnects of the same target.
+    """
+
+    def __init__(self, name, out_dir, output_format):
+        self.name = name
+        self.out_dir = os.path.join(out_dir, name)
+        self.output_format = output_format
+        self.parser = StraceParser(None)
+        self.connected = False
+        self.segments = 0
+        self.segment_started = time.monotonic()
+        self.parse_errors = 0
+        # Previous sample of the counters for computing rates
+        self._sample = (time.monotonic(), 0, 0)
+        self.syscalls_per_s = 0.0
+        self.errors_per_s = 0.0
+
+    def parse_line(self, line):
+        """Parse one line, skipping lines the parser fails to parse"""
+        try:
+            self.parser.parse_line(line)
+        except StraceParseError as ex:
+            self.parse_errors += 1
+            _LOGGER.warning("%s: %s", self.name, ex.args[0])
+
+    def pending_rows(self):
+        """Return the number of parsed rows and events not yet written"""
+        return len(self.parser.entries) + len(self.parser.events)
+
+    def take_segment(self):
+        """
+        Return the names of the next segment file and of its events file,
+        and the dataframes of the parsed rows and events not yet written,
+        and start a new segment
+        """
+        df = self.parser.entries.to_dataframe()
+        df = df.reindex(columns=self.parser.output_columns())
+        df_events = self.parser.events_frame()
+        self.parser.entries = ColumnStore(encoded=ENCODED_COLUMNS)
+        self.parser.events = ColumnStore(encoded=ENCODED_EVENT_COLUMNS)
+        self.segments += 1
+        self.segment_started = time.monotonic()
+        name = os.path.join(self.out_dir, "%s-%06d" % (self.name, self.segments))
+        return (
+            "%s.%s" % (name, self.output_format),
+            df,
+            "%s.events.%s" % (name, self.output_format),
+            df_events,
+        )
+
+    def update_rates(self):
+        """Update the syscalls/s and errors/s rates since the previous update"""
+        now = time.monotonic()
+        syscalls = self.parser.stats["syscalls"]
+        errors = self.parser.stats["syscalls_failed"]
+        then, prev_syscalls, prev_errors = self._sample
+        if now > then:
+            self.syscalls_per_s = (syscalls - prev_syscalls) / (now - then)
+            self.errors_per_s = (errors - prev_errors) / (now - then)
+        self._sample = (now, syscalls, errors)
+
+    def stats(self):
+        """Return the live counters of the target"""
+        return {
+            "connected": self.connected,
+            "syscalls": self.parser.stats["syscalls"],
+            "syscalls_failed": self.parser.stats["syscalls_failed"],
+            "events": self.parser.stats["lines_event"],
+            "syscalls_per_s": round(self.syscalls_per_s, 3),
+            "errors_per_s": round(self.errors_per_s, 3),
+            "parse_errors": self.parse_errors,
+            "unfinished_syscalls": len(self.parser.unfinished_syscalls_stash),
+            "segments": self.segments,
+            "pending_rows": self.pending_rows(),
+        }
+
+
+class StraceServer:
+    """
+    Accepts concurrent streams of strace log lines over Unix or TCP sockets.
+    Each target has its own StraceParser, and the parsed rows are written to
+    rolling output segments per target, the process events of each segment
+    to a separate '.events' file. While a segment is being written,
+    the stream of the target is not read, which makes the sending side wait
+    (backpressure). Parsing runs in the event loop thread: find_filepaths
+    uses SIGALRM for its timeout, which only works in the main thread.
+    """
+
+    def __init__(
+        self,
+        out_dir,
+        output_format="csv",
+        segment_rows=100000,
+        segment_seconds=60.0,
+        stats_interval=10.0,
+    ):
+        self.out_dir = out_dir
+        self.output_format = output_format
+        self.segment_rows = segment_rows
+        self.segment_seconds = segment_seconds
+        self.stats_interval = stats_interval
+        self.targets = {}
+        self._connections = 0
+        self._write_locks = {}
+
+    async def handle_stream(self, reader, writer):
+        """Handle one connection"""
+        self._connections += 1
+        name = "target-%s" % self._connections
+        try:
+            first = await reader.readline()
+        except ValueError:
+            first = b""
+        first = first.decode("utf-8", errors="replace").rstrip("\n")
+        if first == STATS_COMMAND:
+            writer.write((json.dumps(self.stats()) + "\n").encode("utf-8"))
+            await writer.drain()
+            writer.close()
+            return
+        # Targets without a name can not reconnect, so they are dropped on
+        # disconnect
+        anonymous = True
+        command, _, value = first.partition(" ")
+        if command == TARGET_COMMAND and value.strip():
+            # The name is a directory in out_dir, leading dots would allow
+            # '.' and '..'
+            safe_name = re.sub(r"[^\w.-]", "_", value.strip()).lstrip(".")
+            if safe_name:
+                name = safe_name
+                anonymous = False
+            else:
+                _LOGGER.warning(
+                    "Invalid target name '%s', using '%s'", value.strip(), name
+                )
+            first = None
+        target = self.targets.get(name)
+        if target is None:
+            target = TargetStream(name, self.out_dir, self.output_format)
+            self.targets[name] = target
+        elif target.connected:
+            _LOGGER.error("Target '%s' is already connected", name)
+            writer.close()
+            return
+        target.connected = True
+        _LOGGER.info("Target '%s' connected", name)
+        try:
+            if first:
+                target.parse_line(first)
+            await self._read_lines(target, reader)
+        finally:
+            target.connected = False
+            try:
+                await self.flush(target)
+            finally:
+                if anonymous:
+                    del self.targets[name]
+                    self._write_locks.pop(name, None)
+                # Closed after the final segment is written
+                writer.close()
+            _LOGGER.info("Target '%s' disconnected", name)
+
+    async def _read_lines(self, target, reader):
+        lines = 0
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                _LOGGER.error("%s: line longer than %s bytes", target.name, LINE_LIMIT)
+                return
+            if not line:
+                return
+            target.parse_line(line.decode("utf-8", errors="replace"))
+            if target.pending_rows() >= self.segment_rows:
+                await self.flush(target)
+            lines += 1
+            if lines % LINES_PER_YIELD == 0:
+                await asyncio.sleep(0)
+
+    async def flush(self, target):
+        """Write the pending rows of target to a new segment"""
+        lock = self._write_locks.setdefault(target.name, asyncio.Lock())
+        async with lock:
+            if not target.pending_rows():
+                return
+            name, df, events_name, df_events = target.take_segment()
+            os.makedirs(target.out_dir, exist_ok=True)
+            writer = SEGMENT_WRITERS[self.output_format]
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, writer, df, name)
+            if not df_events.empty:
+                await loop.run_in_executor(None, writer, df_events, events_name)
+
+    async def tick(self):
+        """Periodically update the rates and flush segments that are old"""
+        last_log = time.monotonic()
+        while True:
+            await asyncio.sleep(1.0)
+            now = time.monotonic()
+            for target in list(self.targets.values()):
+                if now - target.segment_started >= self.segment_seconds:
+                    await self.flush(target)
+            if now - last_log < self.stats_interval:
+                continue
+            last_log = now
+            for name, target in self.targets.items():
+                target.update_rates()
+                if target.connected:
+                    _LOGGER.info(
+                        "%s: %.1f syscalls/s, %.1f errors/s",
+                        name,
+                        target.syscalls_per_s,
+                        target.errors_per_s,
+                    )
+
+    def stats(self):
+        """Return the live counters of all targets"""
+        return {name: target.stats() for name, target in self.targets.items()}
+
+    async def serve(self, unix_path=None, tcp_address=None):
+        """Serve until SIGINT or SIGTERM, then flush all pending rows"""
+        servers = []
+        if unix_path:
+            servers.append(
+                await asyncio.start_unix_server(
+                    self.handle_stream, path=unix_path, limit=LINE_LIMIT
+                )
+            )
+            _LOGGER.info("Listening on: %s", unix_path)
+        if tcp_address:
+            host, port = tcp_address
+            servers.append(
+                await asyncio.start_server(
+                    self.handle_stream, host=host, port=port, limit=LINE_LIMIT
+                )
+            )
+            _LOGGER.info("Listening on: %s:%s", host, port)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(signum, stop.set)
+        ticker = asyncio.ensure_future(self.tick())
+        await stop.wait()
+        ticker.cancel()
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+        for target in list(self.targets.values()):
+            await self.flush(target)
+        if unix_path and os.path.exists(unix_path):
+            os.remove(unix_path)
+
+
+################################################################################
+
+
+def _tcp_address(value):
+    host, _, port = value.rpartition(":")
+    try:
+        return host or "127.0.0.1", int(port)
+    except ValueError as ex:
+        raise argparse.ArgumentTypeError("expected [HOST:]PORT: %s" % value) from ex
+
+
+def getargs():
+    """Parse command line arguments"""
+    desc = (
+        "Receive strace output streamed over Unix or TCP sockets from many "
+        "targets at the same time, and convert each stream to rolling output "
+        "segments in OUT_DIR/TARGET/. A stream is a sequence of strace log "
+        "lines, optionally preceded by line '#target NAME' that names the "
+        "target. A connection that sends line '#stats' gets the live counters "
+        "of all targets as json. Strace must be run with options "
+        "'-f -tt -T -y -yy -s 2048'."
+    )
+    epil = (
+        "Example: ./%s --unix /tmp/strace.sock --out-dir strace_segments"
+        % os.path.basename(__file__)
+    )
+    parser = argparse.ArgumentParser(description=desc, epilog=epil)
+
+    helpstr = "listen on this Unix socket path"
+    parser.add_argument("--unix", help=helpstr)
+
+    helpstr = "listen on this TCP address, [HOST:]PORT"
+    parser.add_argument("--tcp", help=helpstr, type=_tcp_address)
+
+    helpstr = "write the output segments to this directory (defaults to '.')"
+    parser.add_argument("--out-dir", help=helpstr, default=".")
+
+    helpstr = "output segment format (defaults to --format=csv)"
+    parser.add_argument(
+        "--format", help=helpstr, choices=sorted(SEGMENT_WRITERS), default="csv"
+    )
+
+    helpstr = "start a new segment after this many rows (defaults to 100000)"
+    parser.add_argument("--segment-rows", help=helpstr, type=int, default=100000)
+
+    helpstr = "start a new segment after this many seconds (defaults to 60)"
+    parser.add_argument("--segment-seconds", help=helpstr, type=float, default=60.0)
+
+    helpstr = "log the syscall rates every this many seconds (defaults to 10)"
+    parser.add_argument("--stats-interval", help=helpstr, type=float, default=10.0)
+
+    helpstr = "set the verbose level between 0-3 (defaults to --verbose=1)"
+    parser.add_argument("--verbose", help=helpstr, type=int, default=1)
+
+    args = parser.parse_args()
+    if not args.unix and not args.tcp:
+        parser.error("at least one of --unix or --tcp is required")
+    return args
+
+
+################################################################################
+
+
+def main():
+    """main entry point"""
+    args = getargs()
+    setup_logging(args.verbose)
+    if args.format == "parquet" and pyarrow is None:
+        sys.stderr.write("Error: output format 'parquet' requires pyarrow\n")
+        sys.exit(1)
+    server = StraceServer(
+        args.out_dir,
+        output_format=args.format,
+        segment_rows=args.segment_rows,
+        segment_seconds=args.segment_seconds,
+        stats_interval=args.stats_interval,
+    )
+    asyncio.run(server.serve(args.unix, args.tcp))
+
+
+if __name__ == "__main__":
+    main()
+
+################################################################################
@@ -8,24 +8,67 @@
 
 """ Stracepy utils """
 
+import argparse
 import os
 import sys
 import re
 import csv
+import json
+import time
 import logging
 import signal
 import errno
+import collections
+from array import array
+from contextlib import contextmanager
 from functools import wraps
 
 from tabulate import tabulate
+import numpy as np
 import pandas as pd
 from colorlog import ColoredFormatter, default_log_colors
 
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 ###############################################################################
 
 LOGGER_NAME = "stracepy-logger"
 LOG_SPAM = logging.DEBUG - 1
 
+OUTPUT_FORMATS = ["table", "csv", "jsonl", "parquet"]
+# Results larger than this are not rendered as pretty tables
+TABLE_MAX_ROWS = 10000
+# Number of rows written at a time in the streaming output formats
+OUTPUT_CHUNK_ROWS = 100000
+
+# How partial aggregates, for instance from different strace logs, are merged
+# by merge_partials
+MERGE_AGGREGATES = {
+    "count": "sum",
+    "timed": "sum",
+    "total_time": "sum",
+    "max_time": "max",
+}
+
+# Output settings for print_df, see setup_output
+_OUTPUT = {
+    "format": "table",
+    "limit": None,
+    "offset": 0,
+    "top": None,
+    "file": None,
+    "tables": 0,
+    # List that collects the results instead of outputting them, see
+    # collect_output
+    "collect": None,
+    # Appended to the titles, see title_suffix
+    "title_suffix": "",
+}
+
 ###############################################################################
 
 
@@ -34,10 +77,16 @@ def current_func_name():
     return sys._getframe(1).f_code.co_name
 
 
-def df_to_csv_file(df, name):
-    """Write dataframe to csv file"""
+def df_to_csv_file(df, name, append=False):
+    """Write dataframe to csv file, or append the rows if append is True"""
     df.to_csv(
-        path_or_buf=name, quoting=csv.QUOTE_ALL, sep=",", index=False, encoding="utf-8"
+        path_or_buf=name,
+        quoting=csv.QUOTE_ALL,
+        sep=",",
+        index=False,
+        encoding="utf-8",
+        mode="a" if append else "w",
+        header=not append,
     )
     logging.getLogger(LOGGER_NAME).info("Wrote: %s", name)
 
@@ -94,17 +143,234 @@ def setup_logging(verbosity=1):
     project_logger.setLevel(level)
 
 
-def print_df(df, tablefmt="presto"):
-    """Pretty-print dataframe to stdout"""
+def setup_output(output="table", limit=None, offset=0, top=None, output_file=None):
+    """
+    Setup how print_df outputs dataframes: output format, the slice of rows
+    to output (limit, offset), the number of rows kept by df_top (top), and
+    the output file (defaults to stdout)
+    """
+    if output not in OUTPUT_FORMATS:
+        sys.stderr.write("Error: unknown output format: %s\n" % output)
+        sys.exit(1)
+    if output == "parquet" and pyarrow is None:
+        sys.stderr.write("Error: output format 'parquet' requires pyarrow\n")
+        sys.exit(1)
+    if output == "parquet" and not output_file:
+        sys.stderr.write("Error: output format 'parquet' requires an output file\n")
+        sys.exit(1)
+    _OUTPUT.update(
+        {
+            "format": output,
+            "limit": limit,
+            "offset": offset or 0,
+            "top": top,
+            "file": output_file,
+            "tables": 0,
+        }
+    )
+
+
+def add_output_arguments(parser):
+    """Add the command line arguments of setup_output to argparse parser"""
+    group = parser.add_argument_group("output options")
+    helpstr = (
+        "set the output format (defaults to --output=table). Formats other "
+        "than 'table' are written in chunks, and results of more than %s "
+        "rows are written as csv instead of table" % TABLE_MAX_ROWS
+    )
+    group.add_argument(
+        "--output", help=helpstr, choices=OUTPUT_FORMATS, default="table"
+    )
+    helpstr = (
+        "write the output to this file instead of stdout, required with "
+        "--output=parquet. Tables are written to it as text. If the command "
+        "outputs more than one result, the following results are written to "
+        "numbered files: 'out.1.csv', ..."
+    )
+    group.add_argument("--output-file", help=helpstr)
+    helpstr = "output at most LIMIT rows of each result"
+    group.add_argument("--limit", help=helpstr, type=non_negative_int)
+    helpstr = "skip the first OFFSET rows of each result"
+    group.add_argument("--offset", help=helpstr, type=non_negative_int, default=0)
+    helpstr = (
+        "keep only the top N rows of each result sorted by count or time. "
+        "Commands whose results are not sorted by count or time ignore it "
+        "with a warning."
+    )
+    group.add_argument("--top", help=helpstr, type=non_negative_int, metavar="N")
+
+
+def non_negative_int(value):
+    """Argparse type of the integer arguments that can not be negative"""
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+    if number < 0:
+        raise argparse.ArgumentTypeError("invalid non-negative int value: %r" % value)
+    return number
+
+
+class SmartFormatter(argparse.HelpFormatter):
+    """Help formatter that keeps the line breaks of help strings starting 'R|'"""
+
+    def _split_lines(self, text, width):
+        if text.startswith("R|"):
+            return text[2:].splitlines()
+        return argparse.HelpFormatter._split_lines(self, text, width)
+
+
+def setup_output_from_args(args):
+    """Setup output given the arguments added with add_output_arguments"""
+    setup_output(args.output, args.limit, args.offset, args.top, args.output_file)
+
+
+def output_top():
+    """Return the number of rows df_top keeps as set with setup_output, or None"""
+    return _OUTPUT["top"]
+
+
+def df_top(df, column):
+    """
+    Sort dataframe by column in descending order. If setup_output limits the
+    number of rows, select only the rows that will be output with nlargest
+    instead of sorting the full dataframe.
+    """
+    nrows = _OUTPUT["top"]
+    if _OUTPUT["limit"] is not None:
+        limit = _OUTPUT["offset"] + _OUTPUT["limit"]
+        nrows = limit if nrows is None else min(nrows, limit)
+    if nrows is not None:
+        return df.nlargest(nrows, column)
+    return df.sort_values([column], ascending=False)
+
+
+def print_df(df, tablefmt="presto", title=None):
+    """
+    Output dataframe in the format set with setup_output to stdout or to the
+    output file. Small results are pretty-printed, others are written in
+    chunks.
+    """
+    offset = _OUTPUT["offset"]
+    limit = _OUTPUT["limit"]
+    if offset or limit is not None:
+        end = None if limit is None else offset + limit
+        df = df.iloc[offset:end]
     if df.empty:
         return
-    df = df.fillna("")
-    print(
-        tabulate(
-            df, headers="keys", tablefmt=tablefmt, stralign="left", showindex=False
+    if title:
+        title += _OUTPUT["title_suffix"]
+    if _OUTPUT["collect"] is not None:
+        _OUTPUT["collect"].append((title, df))
+        return
+    output = _OUTPUT["format"]
+    if output == "table" and len(df) > TABLE_MAX_ROWS:
+        logging.getLogger(LOGGER_NAME).warning(
+            "Result has %s rows, writing csv instead of table "
+            "(see --limit and --output)",
+            len(df),
         )
+        output = "csv"
+    name = _next_output_file()
+    if output == "table":
+        _print_table(df, tablefmt, title, name)
+        return
+    if title:
+        logging.getLogger(LOGGER_NAME).info("%s", title)
+    if output == "parquet":
+        df_to_parquet_file(df, name)
+    elif name:
+        with open(name, "w", encoding="utf-8") as out_file:
+            _write_text(df, output, out_file)
+        logging.getLogger(LOGGER_NAME).info("Wrote: %s", name)
+    else:
+        _write_text(df, output, sys.stdout)
+        sys.stdout.flush()
+
+
+@contextmanager
+def collect_output():
+    """
+    Context manager that makes print_df collect the results instead of
+    outputting them. Yields the list the (title, dataframe) tuples are
+    appended to.
+    """
+    collected = []
+    previous = _OUTPUT["collect"]
+    _OUTPUT["collect"] = collected
+    try:
+        yield collected
+    finally:
+        _OUTPUT["collect"] = previous
+
+
+@contextmanager
+def title_suffix(suffix):
+    """Context manager that makes print_df append suffix to the titles"""
+    previous = _OUTPUT["title_suffix"]
+    _OUTPUT["title_suffix"] = suffix
+    try:
+        yield
+    finally:
+        _OUTPUT["title_suffix"] = previous
+
+
+def _print_table(df, tablefmt, title, name):
+    # Pretty-print to stdout, or to file name if given
+    text = tabulate(
+        df.fillna(""),
+        headers="keys",
+        tablefmt=tablefmt,
+        stralign="left",
+        showindex=False,
     )
-    print("")
+    if title:
+        text = "\n\n%s:\n\n%s" % (wrap_text(title), text)
+    if name:
+        with open(name, "w", encoding="utf-8") as out_file:
+            out_file.write(text.lstrip("\n") + "\n")
+        logging.getLogger(LOGGER_NAME).info("Wrote: %s", name)
+    else:
+        print(text)
+        print("")
+
+
+def _next_output_file():
+    # First table goes to the output file as such, following tables from
+    # the same run go to numbered files: 'out.csv', 'out.1.csv', ...
+    name = _OUTPUT["file"]
+    nth = _OUTPUT["tables"]
+    _OUTPUT["tables"] += 1
+    if not name or nth == 0:
+        return name
+    stem, ext = os.path.splitext(name)
+    return "%s.%s%s" % (stem, nth, ext)
+
+
+def _write_text(df, output, stream):
+    for start in range(0, len(df), OUTPUT_CHUNK_ROWS):
+        chunk = df.iloc[start:][:OUTPUT_CHUNK_ROWS]
+        if output == "csv":
+            chunk.to_csv(stream, header=start == 0, index=False, quoting=csv.QUOTE_ALL)
+        else:
+            text = chunk.to_json(orient="records", lines=True)
+            stream.write(text if text.endswith("\n") else text + "\n")
+
+
+def df_to_parquet_file(df, name):
+    """Write dataframe to parquet file in chunks, requires pyarrow"""
+    writer = None
+    try:
+        for start in range(0, len(df), OUTPUT_CHUNK_ROWS):
+            chunk = df.iloc[start:][:OUTPUT_CHUNK_ROWS]
+            table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(name, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    logging.getLogger(LOGGER_NAME).info("Wrote: %s", name)
 
 
 def df_regex_filter(df, column, regex):
@@ -112,6 +378,31 @@ def df_regex_filter(df, column, regex):
     return df[df[column].str.contains(regex, regex=True, na=False)]
 
 
+def merge_partials(df, keys):
+    """
+    Merge the partial aggregates in dataframe df by group keys, each column
+    the way MERGE_AGGREGATES gives
+    """
+    aggregates = {col: MERGE_AGGREGATES[col] for col in df.columns if col not in keys}
+    return df.groupby(keys, sort=False).agg(aggregates).reset_index()
+
+
+def df_timestamp_seconds(df, column="timestamp"):
+    """
+    Return the timestamp column of dataframe df as float seconds. Supports
+    both 'HH:MM:SS.ffffff' (strace -tt) and epoch (strace -ttt) timestamps.
+    Wall-clock timestamps that wrap around midnight keep increasing.
+    """
+    tstamp = df[column].astype(str)
+    if tstamp.empty or not tstamp.str.contains(":", regex=False).any():
+        return pd.to_numeric(tstamp, errors="coerce")
+    seconds = pd.to_timedelta(tstamp, errors="coerce").dt.total_seconds()
+    # Entries are mostly chronological: a jump back by more than half a day
+    # means the capture crossed midnight
+    midnight_wraps = (seconds.diff() < -43200).cumsum()
+    return seconds + midnight_wraps * 86400
+
+
 def wrap_text(text, lilen=80, indent=""):
     """Wrap text to max lilen length lines"""
     text = text.replace("\n", " ")
@@ -125,6 +416,158 @@ def wrap_text(text, lilen=80, indent=""):
 ###############################################################################
 
 
+class EncodedColumn:
+    """
+    Dictionary-encoded column: the distinct values of the column, and an
+    integer code per row referring to one of the distinct values. Suitable
+    for columns that have few distinct values compared to the row count.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.codes = array("i")
+        self._lookup = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def append(self, key, to_value=None):
+        """
+        Append a row. Rows with equal key share the same value, which is the
+        key itself, or to_value(key) called once for each distinct key.
+        """
+        code = self._lookup.get(key)
+        if code is None:
+            code = len(self.values)
+            self._lookup[key] = code
+            self.values.append(key if to_value is None else to_value(key))
+        self.codes.append(code)
+
+    def to_categorical(self):
+        """Return the column as pandas categorical"""
+        codes = np.frombuffer(self.codes, dtype=np.intc).copy()
+        categories = pd.Series(self.values, dtype=object)
+        null = categories.isna().to_numpy()
+        if null.any():
+            # Categoricals have no null categories, null values have code -1
+            remap = np.cumsum(~null) - 1
+            remap[null] = -1
+            codes = remap[codes]
+            categories = categories[~null]
+        return pd.Categorical.from_codes(codes, categories=categories)
+
+
+class ColumnStore:
+    """
+    Column-oriented store for table rows. Columns named in encoded are
+    stored as EncodedColumn, other columns as plain lists.
+    """
+
+    def __init__(self, encoded=()):
+        self.columns = {}
+        self.encoded = frozenset(encoded)
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+
+    def column(self, name):
+        """Return column name, adding an empty column if it does not exist"""
+        col = self.columns.get(name)
+        if col is None:
+            col = EncodedColumn() if name in self.encoded else []
+            self.columns[name] = col
+        return col
+
+    def to_dataframe(self):
+        """
+        Return the stored rows as dataframe. Encoded columns become pandas
+        categoricals, which convert to Arrow dictionary arrays as such.
+        """
+        return pd.DataFrame(
+            {
+                name: col.to_categorical() if isinstance(col, EncodedColumn) else col
+                for name, col in self.columns.items()
+            }
+        )
+
+
+class StageProfiler:
+    """
+    Collects cumulative run time per stage and counters. Stages are timed
+    with the stage context manager, or by wrapping hot-path functions with
+    instrument, which adds no overhead to the functions that are not wrapped.
+    """
+
+    def __init__(self):
+        self.times = collections.defaultdict(float)
+        self.calls = collections.Counter()
+        self.counters = collections.Counter()
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager that adds the time spent in the block to stage name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] += time.perf_counter() - start
+            self.calls[name] += 1
+
+    def instrument(self, func, name):
+        """Return func wrapped to add the time spent in func to stage name"""
+        times = self.times
+        calls = self.calls
+        perf_counter = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                times[name] += perf_counter() - start
+                calls[name] += 1
+
+        return wraps(func)(wrapper)
+
+    def high_water(self, name, value):
+        """Set counter name to value if value is larger than the current one"""
+        if value > self.counters[name]:
+            self.counters[name] = value
+
+    def to_dict(self):
+        """Return the collected stage times and counters as dictionary"""
+        return {
+            "stages": {
+                name: {"calls": self.calls[name], "seconds": round(seconds, 6)}
+                for name, seconds in self.times.items()
+            },
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def to_json_file(self, name):
+        """Write the collected stage times and counters to json file"""
+        with open(name, "w", encoding="utf-8") as out_file:
+            json.dump(self.to_dict(), out_file, indent=2)
+        logging.getLogger(LOGGER_NAME).info("Wrote: %s", name)
+
+    def print_summary(self, total_stage="total"):
+        """Print the collected stage times and counters"""
+        total = self.times.get(total_stage) or sum(self.times.values())
+        df = pd.DataFrame(
+            [
+                (name, self.calls[name], seconds, 100 * seconds / total)
+                for name, seconds in self.times.items()
+            ],
+            columns=["stage", "calls", "seconds", "percent"],
+        ).round({"seconds": 6, "percent": 1})
+        print_df(df, title="Stage timing")
+        df = pd.DataFrame(sorted(self.counters.items()), columns=["counter", "value"])
+        print_df(df, title="Counters")
+
+
+###############################################################################
+
+
 class FunctionTimeoutError(Exception):
     """Function timeout exception"""
 
@@ -8,6 +8,7 @@
 """ Tests for strace2csv.py """
 
 import subprocess
+import json
 import os
 import shutil
 from pathlib import Path
@@ -101,6 +102,98 @@ def test_stracelog_missing_options():
     assert subprocess.run(cmd, check=False).returncode == 1
 
 
+def test_profile():
+    """
+    Test that strace2csv.py --profile-json writes the stage timing and counters
+    """
+    outfile = TEST_WORK_DIR / "strace_firefox_startup.csv"
+    profile = TEST_WORK_DIR / "profile.json"
+    cprofile = TEST_WORK_DIR / "strace2csv.prof"
+
+    cmd = [
+        STRACE2CSV,
+        "--out",
+        outfile,
+        "--profile-json",
+        profile,
+        "--cprofile",
+        cprofile,
+        TEST_DATA_FIREFOX_STARTUP,
+    ]
+    assert subprocess.run(cmd, check=True).returncode == 0
+    assert Path(cprofile).exists()
+    with open(profile, encoding="utf-8") as in_file:
+        summary = json.load(in_file)
+    for stage in ["regex_match", "find_filepaths", "parse", "dataframe", "write"]:
+        assert stage in summary["stages"]
+    counters = summary["counters"]
+    assert counters["rows_written"] == len(pd.read_csv(outfile))
+    assert counters["lines_unfinished"] == counters["lines_resumed"]
+    assert counters["stash_high_water"] >= 1
+
+
+def test_incremental():
+    """
+    Test that strace2csv.py --incremental converts a growing strace log to the
+    same output as the full conversion
+    """
+    outfile = TEST_WORK_DIR / "strace_firefox_startup.csv"
+    reference = TEST_DATA_DIR / "strace_firefox_startup.csv"
+    growing_log = TEST_WORK_DIR / "strace_firefox_startup.log"
+    with open(TEST_DATA_FIREFOX_STARTUP, "rb") as in_file:
+        data = in_file.read()
+
+    events = TEST_WORK_DIR / "strace_firefox_startup.events.csv"
+    cmd = [STRACE2CSV, "--incremental", "--out", outfile, growing_log]
+    # Cut the strace log in the middle of lines, as if strace was still
+    # writing it. The first run sees no complete line. The events file is
+    # written only once the strace log has process events.
+    for size in [20, 3000, 7777, 10001, len(data), len(data)]:
+        with open(growing_log, "wb") as out_file:
+            out_file.write(data[:size])
+        assert subprocess.run(cmd, check=True).returncode == 0
+        assert Path(str(outfile) + ".checkpoint").exists()
+        assert events.exists() == (b"+++" in data[:size])
+    with open(outfile, "rb") as out, open(reference, "rb") as ref:
+        assert out.read() == ref.read()
+    with open(events, "rb") as out:
+        incremental_events = out.read()
+
+    # Full conversion removes the stale checkpoint
+    cmd = [STRACE2CSV, "--out", outfile, growing_log]
+    assert subprocess.run(cmd, check=True).returncode == 0
+    assert not Path(str(outfile) + ".checkpoint").exists()
+    with open(events, "rb") as out:
+        assert out.read() == incremental_events
+    df = pd.read_csv(events, dtype=str, keep_default_na=False)
+    assert df["event"].tolist() == ["exited", "signal"]
+    assert df["pid"].tolist() == ["478765", "478760"]
+    assert df["executable"].tolist() == ["/usr/bin/which", "/usr/bin/firefox"]
+
+
+def test_approx():
+    """
+    Test that strace2csv.py --approx outputs a sample of each pid with weights
+    that add up to the syscall counts
+    """
+    outfile = TEST_WORK_DIR / "strace_sample.csv"
+    reference = TEST_DATA_DIR / "strace_firefox_startup.csv"
+    cmd = [
+        STRACE2CSV,
+        "--approx",
+        "--sample-rows=20",
+        "--out",
+        outfile,
+        TEST_DATA_FIREFOX_STARTUP,
+    ]
+    assert subprocess.run(cmd, check=True).returncode == 0
+    df = pd.read_csv(outfile, keep_default_na=False)
+    df_ref = pd.read_csv(reference, keep_default_na=False)
+    assert len(df) == 20
+    weights = df.groupby("pid")["weight"].sum().round()
+    assert weights.to_dict() == df_ref["pid"].value_counts().to_dict()
+
+
 ################################################################################
 
 
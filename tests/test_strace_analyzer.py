@@ -8,10 +8,15 @@
 """ Tests for strace_analyzer.py """
 
 import subprocess
+import io
 import os
 import shutil
+import stat
 from pathlib import Path
 import pytest
+import pandas as pd
+
+from stracepy.strace_daemon import daemon_request
 
 
 MYDIR = Path(os.path.dirname(os.path.realpath(__file__)))
@@ -20,6 +25,8 @@ TEST_DATA_DIR = MYDIR / "data"
 TEST_DATA_FIREFOX_STARTUP = TEST_DATA_DIR / "strace_firefox_startup.csv"
 
 STRACE_ANALYZER = MYDIR / ".." / "stracepy" / "strace_analyzer.py"
+STRACE2CSV = MYDIR / ".." / "stracepy" / "strace2csv.py"
+TEST_DATA_FIREFOX_STARTUP_LOG = TEST_DATA_DIR / "strace_firefox_startup.log"
 
 
 ################################################################################
@@ -52,6 +59,382 @@ def test_summary():
     assert subprocess.run(cmd, check=True).returncode == 0
 
 
+def test_rate():
+    """
+    Test rate command and its time-series output
+    """
+    rate_csv = TEST_WORK_DIR / "rate.csv"
+    cmd = [
+        STRACE_ANALYZER,
+        TEST_DATA_FIREFOX_STARTUP,
+        "rate",
+        "--bucket=0.005",
+        "--group-by=executable",
+        "--rate-csv",
+        rate_csv,
+    ]
+    assert subprocess.run(cmd, check=True).returncode == 0
+    df = pd.read_csv(rate_csv, keep_default_na=False)
+    assert list(df.columns) == [
+        "bucket",
+        "t_start",
+        "executable",
+        "count",
+        "rate_per_s",
+        "baseline",
+        "burst",
+    ]
+    # Every syscall in the capture is counted in exactly one bucket
+    df_capture = pd.read_csv(TEST_DATA_FIREFOX_STARTUP)
+    assert df["count"].sum() == len(df_capture)
+    assert df["burst"].any()
+    # Only the non-empty buckets are output
+    assert (df["count"] > 0).all()
+
+    for option in ["--bucket=0", "--baseline-window=0", "--baseline-window=1001"]:
+        cmd = [STRACE_ANALYZER, TEST_DATA_FIREFOX_STARTUP, "rate", option]
+        assert subprocess.run(cmd, check=False).returncode == 2, option
+
+
+def test_output_formats():
+    """
+    Test --output, --output-file, --limit, --offset and --top options
+    """
+    outfile = TEST_WORK_DIR / "count_files.csv"
+    cmd = [
+        STRACE_ANALYZER,
+        TEST_DATA_FIREFOX_STARTUP,
+        "count_files",
+        "--output=csv",
+        "--output-file",
+        outfile,
+        "--top=5",
+        "--limit=3",
+        "--offset=1",
+    ]
+    assert subprocess.run(cmd, check=True).returncode == 0
+    df = pd.read_csv(outfile, keep_default_na=False)
+    assert list(df.columns) == ["count", "executable", "filepath"]
+    assert len(df) == 3
+    assert df["count"].is_monotonic_decreasing
+
+    cmd = [
+        STRACE_ANALYZER,
+        TEST_DATA_FIREFOX_STARTUP,
+        "file_access",
+        "--output=jsonl",
+        "--limit=4",
+    ]
+    ret = subprocess.run(cmd, check=True, stdout=subprocess.PIPE)
+    df = pd.read_json(io.BytesIO(ret.stdout), lines=True)
+    assert len(df) == 4
+    assert "filepath" in df.columns
+
+    # --top does not apply to commands whose results are not sorted by count
+    cmd = [STRACE_ANALYZER, TEST_DATA_FIREFOX_STARTUP, "file_access", "--top=5"]
+    ret = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    assert "Option --top does not apply to command 'file_access'" in ret.stderr
+
+    # Tables are written to the output file too
+    outfile = TEST_WORK_DIR / "count_files.txt"
+    cmd = [STRACE_ANALYZER, TEST_DATA_FIREFOX_STARTUP, "count_files"]
+    cmd += ["--output-file", outfile]
+    ret = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, text=True)
+    assert ret.stdout == ""
+    with open(outfile, encoding="utf-8") as in_file:
+        assert in_file.readline() == "Count of file accesses:\n"
+
+    # Negative rows are rejected
+    for option in ["--limit=-1", "--offset=-1", "--top=-1"]:
+        cmd = [STRACE_ANALYZER, TEST_DATA_FIREFOX_STARTUP, "count_files", option]
+        ret = subprocess.run(cmd, check=False, capture_output=True, text=True)
+        assert ret.returncode == 2, option
+        assert "invalid non-negative int value" in ret.stderr, option
+
+
+def test_error_clusters():
+    """
+    Test error_clusters command collapses search path probes
+    """
+    outfile = TEST_WORK_DIR / "error_clusters.csv"
+    cmd = [
+        STRACE_ANALYZER,
+        TEST_DATA_FIREFOX_STARTUP,
+        "error_clusters",
+        "--output=csv",
+        "--output-file",
+        outfile,
+    ]
+    assert subprocess.run(cmd, check=True).returncode == 0
+    df = pd.read_csv(outfile, keep_default_na=False)
+    df_capture = pd.read_csv(TEST_DATA_FIREFOX_STARTUP, keep_default_na=False)
+    assert df["count"].sum() == (df_capture["ret_int"] == "-1").sum()
+    # firefox looks up 'which' from three directories in PATH
+    which = df[df["pattern"] == "*/which"]
+    assert which["count"].tolist() == [3]
+    assert which["dirs"].tolist() == [3]
+
+
+def test_file_tree():
+    """
+    Test file_tree command rolls up file accesses by directory
+    """
+    outfile = TEST_WORK_DIR / "file_tree.csv"
+    cmd = [
+        STRACE_ANALYZER,
+        TEST_DATA_FIREFOX_STARTUP,
+        "file_tree",
+        "--depth=2",
+        "--output=csv",
+        "--output-file",
+        outfile,
+    ]
+    assert subprocess.run(cmd, check=True).returncode == 0
+    df = pd.read_csv(outfile, keep_default_na=False).set_index("path")
+    df_capture = pd.read_csv(TEST_DATA_FIREFOX_STARTUP, keep_default_na=False)
+    filepaths = df_capture["filepath"]
+    assert df.loc["/", "count"] == (filepaths != "").sum()
+    assert df.loc["/", "files"] == filepaths[filepaths != ""].nunique()
+    assert df.loc["/etc", "count"] == filepaths.str.startswith("/etc/").sum()
+    assert df["depth"].max() == 2
+
+    cmd = [
+        STRACE_ANALYZER,
+        TEST_DATA_FIREFOX_STARTUP,
+        "file_tree",
+        "--path-prefix=/usr/local",
+        "--min-count=2",
+        "--output=csv",
+        "--output-file",
+        outfile,
+    ]
+    assert subprocess.run(cmd, check=True).returncode == 0
+    df = pd.read_csv(outfile, keep_default_na=False)
+    # Both '/usr/local/bin/which' and '/usr/local/sbin/which' are accessed
+    # only once, so only '/usr/local' is shown
+    assert df["path"].tolist() == ["/usr/local"]
+    assert df["errors"].tolist() == [2]
+
+
+def test_approx():
+    """
+    Test that --approx estimates from the strace log are within the error
+    bounds of the exact results
+    """
+    df_capture = pd.read_csv(TEST_DATA_FIREFOX_STARTUP, keep_default_na=False)
+    outfile = TEST_WORK_DIR / "count_files.csv"
+    cmd = [
+        STRACE_ANALYZER,
+        "--approx",
+        TEST_DATA_FIREFOX_STARTUP_LOG,
+        "count_files",
+        "--output=csv",
+        "--output-file",
+        outfile,
+    ]
+    assert subprocess.run(cmd, check=True).returncode == 0
+    df = pd.read_csv(outfile, keep_default_na=False)
+    df_exact = (
+        df_capture[df_capture["filepath"] != ""]
+        .groupby(["executable", "filepath"])
+        .size()
+        .reset_index(name="exact")
+    )
+    df = df.merge(df_exact, on=["executable", "filepath"])
+    assert len(df) == len(df_exact)
+    assert (df["count"] >= df["exact"]).all()
+    assert (df["count"] - df["exact"] <= df["error"]).all()
+
+    outfile = TEST_WORK_DIR / "latency.csv"
+    cmd = [
+        STRACE_ANALYZER,
+        "--approx",
+        TEST_DATA_FIREFOX_STARTUP,
+        "latency",
+        "--output=csv",
+        "--output-file",
+        outfile,
+    ]
+    assert subprocess.run(cmd, check=True).returncode == 0
+    df = pd.read_csv(outfile)
+    assert df["count"].sum() == len(df_capture)
+    # Syscalls such as exit_group have no syscall time
+    df = df.dropna(subset=["max_time"])
+    assert (df["p50_time"] <= df["max_time"]).all()
+
+    # The title of every result says it is approximate, or that it is from
+    # the sample only
+    suffixes = {
+        "summary": "(approximate):",
+        "programs_executed": "(approximate):",
+        "file_access": "counts not scaled):",
+        "file_tree": "counts not scaled):",
+    }
+    for command, suffix in suffixes.items():
+        cmd = [STRACE_ANALYZER, "--approx", TEST_DATA_FIREFOX_STARTUP, command]
+        ret = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, text=True)
+        titles = [line for line in ret.stdout.splitlines() if line.endswith(":")]
+        assert titles, command
+        assert all(title.endswith(suffix) for title in titles), command
+
+
+def test_lifecycle():
+    """
+    Test lifecycle command reports how each process ended, from csv, SQLite
+    database, and --approx
+    """
+    strace_log = TEST_WORK_DIR / "strace_crash.log"
+    with open(strace_log, "w", encoding="utf-8") as out_file:
+        out_file.write(
+            '100 10:00:00.000000 execve("/bin/sh", ["sh"], 0x7ffd) = 0 <0.000100>\n'
+            "100 10:00:00.100000 clone(child_stack=NULL, flags=SIGCHLD) = 101 "
+            "<0.000100>\n"
+            "101 10:00:00.200000 read(3</etc/passwd>,  <unfinished ...>\n"
+            "101 10:00:00.300000 +++ killed by SIGSEGV (core dumped) +++\n"
+            "100 10:00:00.300200 --- SIGCHLD {si_signo=SIGCHLD, si_pid=101} ---\n"
+            "100 10:00:00.400000 +++ exited with 3 +++\n"
+        )
+    outfile = TEST_WORK_DIR / "lifecycle.csv"
+    for out in ["strace_crash.csv", "strace_crash.db"]:
+        cmd = [STRACE2CSV, "--out", TEST_WORK_DIR / out, strace_log]
+        assert subprocess.run(cmd, check=True).returncode == 0
+        for approx in [[], ["--approx"]]:
+            cmd = [STRACE_ANALYZER, TEST_WORK_DIR / out, "lifecycle", "--output=csv"]
+            cmd += ["--output-file", outfile] + approx
+            assert subprocess.run(cmd, check=True).returncode == 0
+            df = pd.read_csv(outfile, keep_default_na=False)
+            assert df["processes"].tolist() == [2]
+            assert df["exit_codes"].tolist() == ["3 (1)"]
+            assert df["killed_by"].tolist() == ["SIGSEGV (1)"]
+            df = pd.read_csv(TEST_WORK_DIR / "lifecycle.1.csv", keep_default_na=False)
+            assert df["pid"].tolist() == [100, 101]
+            assert df["parent"].tolist() == ["", "100"]
+            assert df["status"].tolist() == ["exited", "killed"]
+            assert df["duration"].tolist() == [0.4, 0.2]
+            assert df["signals"].tolist() == [1, 0]
+    # A csv written without process events still has the process lifecycles
+    csvfile = TEST_DATA_DIR / "strace_firefox_startup.csv"
+    cmd = [STRACE_ANALYZER, csvfile, "lifecycle", "--output=csv"]
+    cmd += ["--output-file", outfile]
+    assert subprocess.run(cmd, check=True).returncode == 0
+    df = pd.read_csv(outfile)
+    assert df["processes"].tolist() == [1, 1]
+
+
+def test_serve():
+    """
+    Test that --serve answers the same results as the command line, caches
+    them, loads the capture again when it changes, and rejects bad requests
+    """
+    capture = TEST_WORK_DIR / "strace_firefox_startup.csv"
+    shutil.copy(TEST_DATA_FIREFOX_STARTUP, capture)
+    outfile = TEST_WORK_DIR / "count_files.csv"
+    cmd = [STRACE_ANALYZER, capture, "count_files", "--top=5", "--output=csv"]
+    cmd += ["--output-file", outfile]
+    assert subprocess.run(cmd, check=True).returncode == 0
+    df_cli = pd.read_csv(outfile, keep_default_na=False)
+
+    sock_path = TEST_WORK_DIR / "strace_analyzer.sock"
+    request = {"capture": str(capture), "command": "count_files", "top": 5}
+    with subprocess.Popen([STRACE_ANALYZER, "--serve", sock_path]) as daemon:
+        try:
+            responses = [daemon_request(sock_path, request, timeout=10)]
+            assert stat.S_IMODE(os.stat(sock_path).st_mode) == 0o600
+            responses.append(daemon_request(sock_path, request))
+            os.utime(capture)
+            responses.append(daemon_request(sock_path, request))
+            error = daemon_request(sock_path, dict(request, command="unknown"))
+            invalid = [
+                daemon_request(sock_path, dict(request, command="rate", args=args))
+                for args in [{"group_by": "bogus"}, {"depth": "x"}, {"bucket": 0}]
+            ]
+            invalid.append(daemon_request(sock_path, dict(request, top="3")))
+            sql = {"sql": "DELETE FROM syscalls"}
+            invalid.append(
+                daemon_request(sock_path, dict(request, command="query", args=sql))
+            )
+            stats = daemon_request(sock_path, {"command": "#stats"})
+        finally:
+            daemon.terminate()
+        assert daemon.wait(timeout=10) == 0
+
+    assert [response["cached"] for response in responses] == [False, True, False]
+    for response in responses:
+        assert response["ok"]
+        result = response["results"][0]
+        df = pd.DataFrame(result["data"], columns=result["columns"])
+        pd.testing.assert_frame_equal(df, df_cli)
+    assert not error["ok"]
+    assert error["messages"] == ["Unknown command: 'unknown'"]
+    assert error["error"] == "Unknown command: 'unknown'"
+    for response in invalid:
+        assert not response["ok"]
+        assert response["results"] == []
+    assert invalid[0]["error"] == "Invalid value for: group_by"
+    assert invalid[3]["error"] == "Invalid value for: top"
+    assert invalid[4]["error"].startswith("Query failed")
+    assert stats["loads"] == 2
+    assert stats["cache_hits"] == 1
+    assert not sock_path.exists()
+
+
+def test_sqlite_database():
+    """
+    Test commands and query give the same results from csv and SQLite database
+    """
+    database = TEST_WORK_DIR / "strace_firefox_startup.db"
+    cmd = [STRACE2CSV, "--out", database, TEST_DATA_FIREFOX_STARTUP_LOG]
+    assert subprocess.run(cmd, check=True).returncode == 0
+
+    commands = [
+        "summary",
+        "count_files",
+        "device_file_access",
+        "error_clusters",
+        "file_tree",
+    ]
+    for command in commands:
+        outputs = []
+        for capture in [TEST_DATA_FIREFOX_STARTUP, database]:
+            cmd = [STRACE_ANALYZER, capture, command]
+            ret = subprocess.run(cmd, check=True, stdout=subprocess.PIPE)
+            outputs.append(ret.stdout)
+        assert outputs[0] == outputs[1], command
+
+    sql = (
+        "SELECT syscall, COUNT(*) AS count FROM syscalls "
+        "WHERE ret_int = '-1' GROUP BY syscall ORDER BY syscall"
+    )
+    for capture in [TEST_DATA_FIREFOX_STARTUP, database]:
+        cmd = [STRACE_ANALYZER, capture, "query", sql, "--output=jsonl"]
+        ret = subprocess.run(cmd, check=True, stdout=subprocess.PIPE)
+        df = pd.read_json(io.BytesIO(ret.stdout), lines=True)
+        assert df["syscall"].tolist() == ["access", "arch_prctl", "stat"]
+        assert df["count"].tolist() == [2, 2, 3]
+
+    # Queries can not change the strace log or create files
+    attached = TEST_WORK_DIR / "attached.db"
+    statements = [
+        "CREATE TABLE changed (a)",
+        "DELETE FROM syscalls",
+        "UPDATE syscalls SET pid = ''",
+        "ATTACH '%s' AS attached" % attached,
+        "-- statement that returns no rows",
+    ]
+    for capture in [TEST_DATA_FIREFOX_STARTUP, database]:
+        for sql in statements:
+            cmd = [STRACE_ANALYZER, capture, "query", sql]
+            ret = subprocess.run(cmd, check=False, capture_output=True, text=True)
+            assert ret.returncode == 1, sql
+            assert "Query failed" in ret.stderr, sql
+            assert "Traceback" not in ret.stderr, sql
+    assert not attached.exists()
+    sql = "SELECT COUNT(*) AS count FROM sqlite_master WHERE name = 'changed'"
+    cmd = [STRACE_ANALYZER, database, "query", sql, "--output=jsonl"]
+    ret = subprocess.run(cmd, check=True, stdout=subprocess.PIPE)
+    assert pd.read_json(io.BytesIO(ret.stdout), lines=True)["count"].tolist() == [0]
+
+
 ################################################################################
 
 
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2021 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: MIT
+
+# pylint: disable=invalid-name
+
+""" Tests for strace_difftest.py """
+
+import subprocess
+import os
+import shutil
+import json
+from pathlib import Path
+import pytest
+
+from stracepy.strace_difftest import diff_engines, engine_dict
+
+MYDIR = Path(os.path.dirname(os.path.realpath(__file__)))
+TEST_WORK_DIR = MYDIR / "strace_difftest_test_data"
+TEST_DATA_DIR = MYDIR / "data"
+TEST_DATA_FIREFOX_STARTUP = TEST_DATA_DIR / "strace_firefox_startup.log"
+
+STRACE_DIFFTEST = MYDIR / ".." / "stracepy" / "strace_difftest.py"
+
+# Inputs on which an engine once crashed or disagreed with the reference
+REGRESSION_LOGS = {
+    "resumed_ret_int_with_question_mark": (
+        "100 12:00:00.000001 read(3,  <unfinished ...>\n"
+        '100 12:00:00.000002 <... read resumed>"x", 1) = 1?2 <0.000001>\n'
+    ),
+    "incremental_first_cut_without_rows": (
+        "100 12:00:00.000001 close(3) = 0 <0.000001>\n"
+    ),
+    "event_without_pid": (
+        '100 12:00:00.000001 open("/etc/hosts", O_RDONLY) = 3 <0.000001>\n'
+        "+++ exited with 0 +++\n"
+    ),
+}
+
+# Regression logs the reference parser rejects with a parse error
+REJECTED_LOGS = ["event_without_pid"]
+
+
+################################################################################
+
+
+@pytest.fixture(autouse=True)
+def set_up_test_data():
+    """Fixture to set up the test data"""
+    print("setup")
+    shutil.rmtree(TEST_WORK_DIR, ignore_errors=True)
+    TEST_WORK_DIR.mkdir(parents=True, exist_ok=True)
+    yield "resource"
+    print("clean up")
+    shutil.rmtree(TEST_WORK_DIR)
+
+
+def test_help():
+    """Test running strace_difftest with -h"""
+    cmd = ["python3", STRACE_DIFFTEST, "-h"]
+    assert subprocess.run(cmd, check=True).returncode == 0
+
+
+def test_difftest():
+    """Test the engines agree on generated, fuzzed, and firefox strace logs"""
+    out = TEST_WORK_DIR / "throughput.json"
+    cmd = [
+        "python3",
+        STRACE_DIFFTEST,
+        TEST_DATA_FIREFOX_STARTUP,
+        "--seeds=2",
+        "--fuzz=3",
+        "--lines=500",
+        "--perf-lines=2000",
+        "--throughput-json",
+        out,
+    ]
+    ret = subprocess.run(cmd, check=False, capture_output=True, text=True)
+    assert ret.returncode == 0, ret.stdout
+    assert "Tested 9 inputs, 0 mismatches" in ret.stdout
+    with open(out, encoding="utf-8") as in_file:
+        throughput = json.load(in_file)
+    assert set(throughput) == set(engine_dict)
+    assert all(row["lines_per_s"] > 0 for row in throughput.values())
+
+    # Throughput far below the baseline fails
+    baseline = {
+        engine: dict(row, lines_per_s=row["lines_per_s"] * 100)
+        for engine, row in throughput.items()
+    }
+    with open(out, "w", encoding="utf-8") as out_file:
+        json.dump(baseline, out_file)
+    cmd = [
+        "python3",
+        STRACE_DIFFTEST,
+        "--seeds=0",
+        "--perf-lines=2000",
+        "--engines=incremental",
+        "--baseline",
+        out,
+    ]
+    ret = subprocess.run(cmd, check=False, capture_output=True, text=True)
+    assert ret.returncode == 1
+    assert "Throughput regression: incremental" in ret.stdout
+
+
+@pytest.mark.parametrize("name", list(REGRESSION_LOGS))
+def test_regression_logs(name):
+    """Test the engines agree on the inputs that once crashed them"""
+    strace_log = TEST_WORK_DIR / ("%s.log" % name)
+    strace_log.write_text(REGRESSION_LOGS[name], encoding="utf-8")
+    results = diff_engines(str(strace_log), list(engine_dict), str(TEST_WORK_DIR))
+    assert bool(results["reference"]["error"]) == (name in REJECTED_LOGS)
+    for engine, result in results.items():
+        assert result["mismatch"] is None, engine
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2021 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: MIT
+
+# pylint: disable=invalid-name
+
+""" Tests for strace_fleet.py """
+
+import subprocess
+import os
+import shutil
+from pathlib import Path
+import pytest
+import pandas as pd
+
+
+MYDIR = Path(os.path.dirname(os.path.realpath(__file__)))
+TEST_WORK_DIR = MYDIR / "strace_fleet_test_data"
+TEST_DATA_DIR = MYDIR / "data"
+TEST_DATA_FIREFOX_STARTUP = TEST_DATA_DIR / "strace_firefox_startup.csv"
+
+STRACE_FLEET = MYDIR / ".." / "stracepy" / "strace_fleet.py"
+STRACE_ANALYZER = MYDIR / ".." / "stracepy" / "strace_analyzer.py"
+
+
+################################################################################
+
+
+@pytest.fixture(autouse=True)
+def set_up_test_data():
+    """Fixture to set up the test data"""
+    print("setup")
+    shutil.rmtree(TEST_WORK_DIR, ignore_errors=True)
+    TEST_WORK_DIR.mkdir(parents=True, exist_ok=True)
+    yield "resource"
+    print("clean up")
+    shutil.rmtree(TEST_WORK_DIR)
+
+
+def test_help():
+    """
+    Test 'help' command line argument
+    """
+    cmd = [STRACE_FLEET, "-h"]
+    assert subprocess.run(cmd, check=True).returncode == 0
+
+
+def test_count_errors():
+    """
+    Test count_errors merges the counts from all strace logs in a directory
+    """
+    captures = TEST_WORK_DIR / "captures"
+    captures.mkdir()
+    for name in ["bench1.csv", "bench2.csv", "bench3.csv"]:
+        shutil.copy(TEST_DATA_FIREFOX_STARTUP, captures / name)
+    outfile = TEST_WORK_DIR / "count_errors.csv"
+
+    cmd = [
+        STRACE_FLEET,
+        captures,
+        "count_errors",
+        "--jobs=2",
+        "--output=csv",
+        "--output-file",
+        outfile,
+    ]
+    assert subprocess.run(cmd, check=True).returncode == 0
+    df_capture = pd.read_csv(TEST_DATA_FIREFOX_STARTUP, keep_default_na=False)
+    errors = (df_capture["ret_int"] == "-1").sum()
+    df = pd.read_csv(outfile, keep_default_na=False)
+    assert df["count"].sum() == 3 * errors
+    # Per-capture breakdown is written to the numbered output file
+    df = pd.read_csv(TEST_WORK_DIR / "count_errors.1.csv", keep_default_na=False)
+    assert len(df) == 3
+    assert df["count"].tolist() == [errors] * 3
+
+
+def test_same_as_analyzer():
+    """
+    Test that strace_fleet.py over one strace log gives the same result as
+    strace_analyzer.py
+    """
+    for command in ["count_errors", "count_files"]:
+        outputs = []
+        for script in [STRACE_FLEET, STRACE_ANALYZER]:
+            outfile = TEST_WORK_DIR / ("%s.csv" % script.stem)
+            cmd = [
+                script,
+                TEST_DATA_FIREFOX_STARTUP,
+                command,
+                "--output=csv",
+                "--output-file",
+                outfile,
+            ]
+            assert subprocess.run(cmd, check=True).returncode == 0
+            df = pd.read_csv(outfile, keep_default_na=False)
+            outputs.append(df.sort_values(list(df.columns), ignore_index=True))
+        assert outputs[0].equals(outputs[1]), command
+
+
+def test_no_captures():
+    """
+    Test that strace_fleet.py fails if the glob pattern matches no files
+    """
+    cmd = [STRACE_FLEET, str(TEST_WORK_DIR / "*.csv"), "count_errors"]
+    assert subprocess.run(cmd, check=False).returncode == 1
+
+
+################################################################################
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
+
+
+################################################################################
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2021 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: MIT
+
+# pylint: disable=invalid-name
+
+""" Tests for strace_server.py """
+
+import subprocess
+import os
+import shutil
+import socket
+import json
+import time
+from pathlib import Path
+import pytest
+import pandas as pd
+
+
+MYDIR = Path(os.path.dirname(os.path.realpath(__file__)))
+TEST_WORK_DIR = MYDIR / "strace_server_test_data"
+TEST_DATA_DIR = MYDIR / "data"
+TEST_DATA_FIREFOX_STARTUP = TEST_DATA_DIR / "strace_firefox_startup.log"
+TEST_DATA_FIREFOX_STARTUP_CSV = TEST_DATA_DIR / "strace_firefox_startup.csv"
+
+STRACE_SERVER = MYDIR / ".." / "stracepy" / "strace_server.py"
+
+
+################################################################################
+
+
+@pytest.fixture(autouse=True)
+def set_up_test_data():
+    """Fixture to set up the test data"""
+    print("setup")
+    shutil.rmtree(TEST_WORK_DIR, ignore_errors=True)
+    TEST_WORK_DIR.mkdir(parents=True, exist_ok=True)
+    yield "resource"
+    print("clean up")
+    shutil.rmtree(TEST_WORK_DIR)
+
+
+def connect(path, timeout=10):
+    """Connect to Unix socket path, waiting until the server listens"""
+    deadline = time.monotonic() + timeout
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(str(path))
+            return sock
+        except (FileNotFoundError, ConnectionRefusedError):
+            sock.close()
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def send_stream(path, data):
+    """Send data to Unix socket path and wait until the server closes it"""
+    with connect(path) as sock:
+        sock.sendall(data)
+        sock.shutdown(socket.SHUT_WR)
+        while sock.recv(4096):
+            pass
+
+
+def test_help():
+    """
+    Test 'help' command line argument
+    """
+    cmd = [STRACE_SERVER, "-h"]
+    assert subprocess.run(cmd, check=True).returncode == 0
+
+
+def test_stream_targets():
+    """
+    Test that strace_server.py converts streams from two targets to rolling
+    segments that together have the same rows as strace2csv.py output, and
+    forgets the targets without a name on disconnect
+    """
+    sock_path = TEST_WORK_DIR / "strace.sock"
+    out_dir = TEST_WORK_DIR / "segments"
+    with open(TEST_DATA_FIREFOX_STARTUP, "rb") as in_file:
+        data = in_file.read()
+
+    cmd = [
+        STRACE_SERVER,
+        "--unix",
+        sock_path,
+        "--out-dir",
+        out_dir,
+        "--segment-rows=50",
+    ]
+    with subprocess.Popen(cmd) as server:
+        try:
+            send_stream(sock_path, b"#target firefox-1\n" + data)
+            # Resumes the state of target 'firefox-2' after the reconnect
+            half = data.index(b"\n", len(data) // 2) + 1
+            send_stream(sock_path, b"#target firefox-2\n" + data[:half])
+            send_stream(sock_path, b"#target firefox-2\n" + data[half:])
+            # Target without a name is dropped on disconnect, after its
+            # segments are written
+            send_stream(sock_path, data)
+            with connect(sock_path) as sock:
+                sock.sendall(b"#stats\n")
+                stats = json.loads(sock.makefile().readline())
+        finally:
+            server.terminate()
+        assert server.wait(timeout=10) == 0
+
+    df_ref = pd.read_csv(
+        TEST_DATA_FIREFOX_STARTUP_CSV, dtype=str, keep_default_na=False
+    )
+    assert sorted(stats) == ["firefox-1", "firefox-2"]
+    assert list((out_dir / "target-4").glob("*[0-9].csv"))
+    for target, target_stats in stats.items():
+        assert target_stats["syscalls"] == len(df_ref)
+        assert target_stats["parse_errors"] == 0
+        segments = sorted((out_dir / target).glob("*[0-9].csv"))
+        assert len(segments) == target_stats["segments"] > 1
+        df = pd.concat(
+            [pd.read_csv(name, dtype=str, keep_default_na=False) for name in segments],
+            ignore_index=True,
+        )
+        pd.testing.assert_frame_equal(df, df_ref)
+        events = sorted((out_dir / target).glob("*.events.csv"))
+        df = pd.concat(
+            [pd.read_csv(name, dtype=str, keep_default_na=False) for name in events],
+            ignore_index=True,
+        )
+        assert target_stats["events"] == len(df) == 2
+        assert list(df["event"]) == ["exited", "signal"]
+    assert not sock_path.exists()
+
+
+def test_unsafe_target_names():
+    """
+    Test that strace_server.py writes the segments of targets named '.',
+    '..', or with path separators only below the output directory
+    """
+    sock_path = TEST_WORK_DIR / "strace.sock"
+    out_dir = TEST_WORK_DIR / "segments"
+    with open(TEST_DATA_FIREFOX_STARTUP, "rb") as in_file:
+        data = in_file.read()
+
+    cmd = [STRACE_SERVER, "--unix", sock_path, "--out-dir", out_dir]
+    with subprocess.Popen(cmd) as server:
+        try:
+            for name in [b".", b"..", b"...", b"../escaped"]:
+                send_stream(sock_path, b"#target " + name + b"\n" + data)
+            with connect(sock_path) as sock:
+                sock.sendall(b"#stats\n")
+                stats = json.loads(sock.makefile().readline())
+        finally:
+            server.terminate()
+        assert server.wait(timeout=10) == 0
+
+    # The targets with invalid names get no name, so they are dropped on
+    # disconnect
+    assert sorted(stats) == ["_escaped"]
+    targets = ["_escaped", "target-1", "target-2", "target-3"]
+    assert sorted(path.name for path in TEST_WORK_DIR.iterdir()) == ["segments"]
+    assert sorted(path.name for path in out_dir.iterdir()) == targets
+    for target in targets:
+        assert list((out_dir / target).glob("*[0-9].csv"))
+
+
+################################################################################
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
+
+
+################################################################################
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2021 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: MIT
+
+# pylint: disable=invalid-name
+
+""" Tests for utils.py """
+
+import math
+
+import pandas as pd
+
+from stracepy.utils import ColumnStore, EncodedColumn
+from stracepy.strace2csv import _tuple_to_list_str
+
+
+################################################################################
+
+
+def _is_null(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def test_encoded_column():
+    """Test EncodedColumn keeps one value per distinct key"""
+    rows = ["read", None, "read", "open", float("nan"), "open", ""]
+    col = EncodedColumn()
+    for row in rows:
+        col.append(row)
+    assert len(col) == len(rows)
+    assert col.values == ["read", None, "open", col.values[3], ""]
+    categorical = col.to_categorical()
+    assert list(categorical.categories) == ["read", "open", ""]
+    values = list(categorical)
+    assert [_is_null(value) for value in values] == [_is_null(row) for row in rows]
+    assert [value for value in values if not _is_null(value)] == [
+        row for row in rows if not _is_null(row)
+    ]
+
+
+def test_column_store():
+    """Test ColumnStore.to_dataframe round-trips the appended rows"""
+    rows = [
+        ("100", ("/etc/passwd",), "0"),
+        ("101", (), "-1"),
+        ("100", ("/etc/passwd",), "3"),
+        ("102", ("/lib/libc.so", "/etc/ld.so.cache"), None),
+    ]
+    store = ColumnStore(encoded=["pid", "all_filepaths"])
+    assert len(store) == 0
+    assert store.to_dataframe().empty
+    for pid, filepaths, ret_int in rows:
+        store.column("pid").append(pid)
+        store.column("all_filepaths").append(filepaths, _tuple_to_list_str)
+        store.column("ret_int").append(ret_int)
+    assert len(store) == len(rows)
+    df = store.to_dataframe()
+    assert list(df.columns) == ["pid", "all_filepaths", "ret_int"]
+    assert isinstance(df["pid"].dtype, pd.CategoricalDtype)
+    assert isinstance(df["all_filepaths"].dtype, pd.CategoricalDtype)
+    assert not isinstance(df["ret_int"].dtype, pd.CategoricalDtype)
+    assert list(df["pid"]) == [row[0] for row in rows]
+    assert list(df["all_filepaths"]) == [str(list(row[1])) for row in rows]
+    assert list(df["all_filepaths"])[1] == "[]"
+    # The string of equal filepaths tuples is built only once
+    assert len(df["all_filepaths"].cat.categories) == 3
+    assert list(df["ret_int"])[:3] == ["0", "-1", "3"]
+    assert _is_null(list(df["ret_int"])[3])